@@ -0,0 +1,134 @@
+"""
+Generates the monthly reports (PDF and XLSX) of a year from the command line,
+without a browser session or Streamlit, building the months in parallel processes.
+
+    python batch_reports.py --year 2025
+    python batch_reports.py --year 2025 --months 1 2 3 --report-type tasks --formats pdf --output-dir reports
+    python batch_reports.py --year 2025 --credentials .streamlit/secrets.toml --no-sync
+
+The ClickUp credentials are read from CLICKUP_TEAM_ID and CLICKUP_API_KEY
+or, with --credentials, from a TOML file with team_id and API_KEY (the same
+keys as the Streamlit secrets). The local store is synced with ClickUp first
+unless --no-sync is given. Exits with code 1 if any report fails.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+REPORT_TYPES = {'days': 'Grouped by days', 'tasks': 'Grouped by tasks'}
+FORMATS = ('pdf', 'xlsx')
+PROCESSES = os.cpu_count() or 1
+
+
+def load_credentials(path):
+    """Sets CLICKUP_TEAM_ID / CLICKUP_API_KEY from a TOML file, without overriding the environment."""
+    # solo hace falta con --credentials; tomllib es de Python 3.11, antes el paquete tomli
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        import tomli as tomllib
+    with open(path, 'rb') as credentials_file:
+        secrets = tomllib.load(credentials_file)
+    for variable, key in (('CLICKUP_TEAM_ID', 'team_id'), ('CLICKUP_API_KEY', 'API_KEY')):
+        if key in secrets:
+            os.environ.setdefault(variable, str(secrets[key]))
+
+
+def month_pdf(year, month, report_type, path):
+    """Monthly report of month/year as PDF bytes, or None without time entries (see local_store.month_report)."""
+    # se importan en el proceso que genera el informe; con la ruta del almacen
+    # explicita no hace falta el team id, asi que nunca se llega a st.secrets
+    from local_store import month_report
+    from rendering import build_pdf_report
+    report = month_report(year, month, report_type, path)
+    if report is None:
+        return None
+    return build_pdf_report([], [report], "Tasks at " + str(month) + '/' + str(year))
+
+
+def month_xlsx(year, month, report_type, path):
+    """Monthly report of month/year as XLSX bytes, or None without time entries (see local_store.month_report)."""
+    from local_store import month_report
+    from rendering import build_xlsx_report
+    report = month_report(year, month, report_type, path)
+    if report is None:
+        return None
+    return build_xlsx_report([report])
+
+
+def get_months(year, today, first_day):
+    # del primer mes con registros (o enero) hasta el mes en curso (o diciembre)
+    first = first_day.month if year == first_day.year else 1
+    last = today.month if year == today.year else 12
+    return list(range(first, last + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monthly time tracking reports of a year, without Streamlit.")
+    parser.add_argument('--year', type=int, required=True)
+    parser.add_argument('--months', type=int, nargs='+', choices=range(1, 13), metavar='MONTH', help="months to generate (default: every month of the year up to today)")
+    parser.add_argument('--report-type', choices=list(REPORT_TYPES) + ['both'], default='both')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--output-dir', default='reports')
+    parser.add_argument('--credentials', help="TOML file with team_id and API_KEY (default: environment variables)")
+    parser.add_argument('--store', help="SQLite store to read (default: the dashboard's local store)")
+    parser.add_argument('--no-sync', action='store_true', help="use the local store as it is, without asking ClickUp for changes")
+    parser.add_argument('--processes', type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    if args.credentials:
+        load_credentials(args.credentials)
+    if not (os.environ.get('CLICKUP_TEAM_ID') and os.environ.get('CLICKUP_API_KEY')):
+        parser.error("set CLICKUP_TEAM_ID and CLICKUP_API_KEY or pass --credentials")
+
+    # las credenciales van en el entorno, que heredan los procesos: nunca se llega a st.secrets
+    from common_functions import local_today, TRACKING_START_DATE
+    from local_store import sync_store, get_store_path
+    builders = {'pdf': month_pdf, 'xlsx': month_xlsx}
+    store = args.store or get_store_path() # los procesos reciben la ruta, no el team id
+
+    started = time.perf_counter()
+    if not args.no_sync:
+        failed = sync_store(path=args.store)
+        if failed:
+            print("Warning:", len(failed), "time entry windows could not be downloaded; their reports may be incomplete", file=sys.stderr)
+
+    months = args.months or get_months(args.year, local_today(), TRACKING_START_DATE)
+    report_types = list(REPORT_TYPES) if args.report_type == 'both' else [args.report_type]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    errors = 0
+    # spawn: los procesos no heredan el event loop ni los hilos del cliente de ClickUp
+    with ProcessPoolExecutor(max_workers=args.processes or PROCESSES, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {}
+        for month in months:
+            for report_type in report_types:
+                for filetype in args.formats:
+                    filename = f"report_{args.year}-{month:02}_{report_type}.{filetype}"
+                    future = pool.submit(builders[filetype], args.year, month, REPORT_TYPES[report_type], store)
+                    futures[future] = filename
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                data = future.result()
+            except Exception as e:
+                errors += 1
+                print("Error:", filename + ":", repr(e), file=sys.stderr)
+                continue
+            if data is None:
+                print("Skipped:", filename, "(no time entries)")
+                continue
+            with open(os.path.join(args.output_dir, filename), 'wb') as output:
+                output.write(data)
+            print("Written:", os.path.join(args.output_dir, filename))
+
+    print(f"{len(futures) - errors} of {len(futures)} reports in {time.perf_counter() - started:.1f}s")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
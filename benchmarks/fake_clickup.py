@@ -0,0 +1,130 @@
+import bisect
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+#################################################################
+#                                                               #
+# Local stand-in for the ClickUp API                            #
+#                                                               #
+#################################################################
+# Sirve un workspace sintetico (ver workspace.py) en /team/{id}/task,
+# /team/{id}/time_entries y /team/{id}/space, con paginas de 100 tareas, una
+# latencia fija por peticion y, opcionalmente, el rate limit de ClickUp
+# (429 y cabeceras X-RateLimit-*), como la API real.
+
+PAGE_SIZE = 100
+ROUTE = re.compile(r"^/team/(?P<team_id>[^/]+)/(?P<endpoint>task|time_entries|space)$")
+
+
+class FakeClickUp:
+    """
+    The data served and the request counters. latency is in seconds; with
+    rate_limit, only that many requests are answered every rate_window seconds.
+    """
+
+    def __init__(self, workspace, latency=0.05, rate_limit=None, rate_window=60):
+        self.tasks = workspace['tasks']
+        self.spaces = workspace['spaces']
+        self.entries = sorted(workspace['time_entries'], key=lambda entry: int(entry['start']))
+        self.entry_starts = [int(entry['start']) for entry in self.entries]
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = {'task': 0, 'time_entries': 0, 'space': 0}
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.window_started = time.time()
+        self.window_requests = 0
+        self.rate_limited = 0
+
+    def take_request(self):
+        """Rate limit headers for this request, and whether it is over the limit."""
+        if self.rate_limit is None:
+            return {}, False
+        with self.lock:
+            now = time.time()
+            if now - self.window_started >= self.rate_window:
+                self.window_started = now
+                self.window_requests = 0
+            self.window_requests += 1
+            over = self.window_requests > self.rate_limit
+            if over:
+                self.rate_limited += 1
+            headers = {
+                "X-RateLimit-Limit": str(self.rate_limit),
+                "X-RateLimit-Remaining": str(max(self.rate_limit - self.window_requests, 0)),
+                "X-RateLimit-Reset": str(int(self.window_started + self.rate_window)),
+            }
+        return headers, over
+
+    def get(self, endpoint, query):
+        with self.lock:
+            self.requests[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if endpoint == 'task':
+            return self.get_tasks(query)
+        if endpoint == 'time_entries':
+            return self.get_time_entries(query)
+        return {'spaces': self.spaces}
+
+    def get_tasks(self, query):
+        tasks = self.tasks
+        if 'date_updated_gt' in query:
+            updated_after = int(query['date_updated_gt'])
+            tasks = [task for task in tasks if int(task['date_updated']) > updated_after]
+        page = int(query.get('page', 0))
+        page_tasks = tasks[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        return {'tasks': page_tasks, 'last_page': (page + 1) * PAGE_SIZE >= len(tasks)}
+
+    def get_time_entries(self, query):
+        start = int(query['start_date'])
+        end = int(query['end_date'])
+        first = bisect.bisect_left(self.entry_starts, start)
+        last = bisect.bisect_right(self.entry_starts, end)
+        return {'data': self.entries[first:last]}
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = ROUTE.match(url.path)
+        if match is None:
+            self.send_error(404)
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        rate_headers, over_limit = self.server.clickup.take_request()
+        if over_limit:
+            body = json.dumps({"err": "Rate limit reached", "ECODE": "APP_002"}).encode()
+            self.send_response(429)
+        else:
+            body = json.dumps(self.server.clickup.get(match.group('endpoint'), query)).encode()
+            self.send_response(200)
+        for name, value in rate_headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # sin una linea por peticion en la salida del benchmark
+
+
+def start_server(workspace, latency=0.05, rate_limit=None, rate_window=60, port=0):
+    """
+    Serves workspace on localhost in a background thread. Returns (server,
+    api_url); point CLICKUP_API_URL at api_url and call server.shutdown() at
+    the end. server.clickup.requests counts the requests answered by
+    endpoint and server.clickup.rate_limited those rejected with 429.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.clickup = FakeClickUp(workspace, latency, rate_limit, rate_window)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://127.0.0.1:" + str(server.server_address[1])
@@ -0,0 +1,173 @@
+"""
+Times every stage of the dashboard pipeline against a synthetic workspace
+served by a local stand-in of the ClickUp API, and reports the wall time and
+the peak memory allocated by each stage.
+
+    python benchmarks/run_benchmarks.py --tasks 5000 --depth 4 --days 730 --entries-per-day 10
+    python benchmarks/run_benchmarks.py --save results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --tolerance 0.25
+
+With --baseline, the run fails (exit code 1) when a stage is slower than the
+baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from workspace import generate_workspace
+from fake_clickup import start_server
+
+# Añadir el directorio raíz del proyecto a sys.path (common_functions y local_store se importan en run_pipeline)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class Stages:
+    """Runs and records the stages: seconds, peak MB allocated and rows of the result."""
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.results = []
+
+    def run(self, name, function, *args, **kwargs):
+        if self.memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - started
+        peak_mb = None
+        if self.memory:
+            peak_mb = (tracemalloc.get_traced_memory()[1] - baseline) / 1024 / 1024
+        rows = len(result) if isinstance(result, (pd.DataFrame, pd.Series, list)) else None
+        self.results.append({'stage': name, 'seconds': seconds, 'peak_mb': peak_mb, 'rows': rows})
+        return result
+
+    def table(self):
+        return pd.DataFrame(self.results).astype({'rows': 'Int64'}).set_index('stage')
+
+
+def run_pipeline(stages, args):
+    # se importa despues de configurar CLICKUP_API_URL (ver main)
+    from common_functions import (
+        get_all_tasks,
+        get_time_entries_chunked,
+        build_period_report,
+        build_month_report,
+        build_range_report,
+        slice_rollup,
+        local_now,
+        local_day_ms,
+    )
+    from rendering import pie_chart, render_figure, build_pdf_report, build_xlsx_report
+    from local_store import sync_store, load_tasks, load_daily_rollup, load_month_rollup, load_months_rollup
+
+    now = local_now().tz_localize(None) # dias en REPORT_TIMEZONE, como la app
+    first_day = now.normalize() - pd.Timedelta(days=args.days)
+    start_ms = local_day_ms(first_day)
+    end_ms = int(local_now().timestamp() * 1000)
+
+    stages.run('get_all_tasks', get_all_tasks)
+    stages.run('get_time_entries_chunked', lambda: get_time_entries_chunked(start_ms, end_ms)[0])
+
+    store_path = os.path.join(args.store_dir, 'benchmark.sqlite3')
+
+    def sync(full):
+        sync_store(full=full, path=store_path) # devuelve las ventanas que fallaron, no filas
+
+    stages.run('sync_store (full)', sync, True)
+    stages.run('sync_store (delta)', sync, False)
+    tasks = stages.run('load_tasks', load_tasks, store_path)
+    rollup = stages.run('load_daily_rollup', load_daily_rollup, tasks, path=store_path)
+
+    week_start = now.normalize() - pd.Timedelta(days=now.weekday())
+    month_start = now.normalize().replace(day=1)
+    stages.run('build_period_report (week)', build_period_report, rollup, week_start)
+    stages.run('build_period_report (month)', build_period_report, rollup, month_start)
+    all_time = stages.run('build_period_report (all time)', build_period_report, rollup, first_day)
+
+    month = now - pd.DateOffset(months=1) # ultimo mes completo
+    month_data = stages.run('load_month_rollup', lambda: slice_rollup(load_month_rollup(month.year, month.month, tasks, store_path)))
+    by_days = stages.run('build_month_report (days)', build_month_report, month_data, 'Grouped by days', tasks)
+    by_tasks = stages.run('build_month_report (tasks)', build_month_report, month_data, 'Grouped by tasks', tasks)
+    first_month = now - pd.DateOffset(months=11) # ultimos 12 meses
+    months = ((first_month.year, first_month.month), (now.year, now.month))
+    year_data = stages.run('load_months_rollup (12 months)', lambda: slice_rollup(load_months_rollup(*months, tasks, store_path)))
+    stages.run('build_range_report (12 months)', build_range_report, year_data, *months)
+
+    chart = stages.run('pie_chart render', lambda: render_figure(pie_chart(all_time['miliseconds'].drop('Total'))))
+    stages.run('build_pdf_report', build_pdf_report, [chart], [by_days, by_tasks], "Tasks at " + str(month.month) + '/' + str(month.year))
+    stages.run('build_xlsx_report', build_xlsx_report, [by_days, by_tasks])
+
+
+def compare(results, baseline, tolerance):
+    """Stages slower than baseline * (1 + tolerance), as (stage, seconds, baseline seconds)."""
+    previous = {result['stage']: result['seconds'] for result in baseline}
+    return [(result['stage'], result['seconds'], previous[result['stage']]) for result in results
+            if result['stage'] in previous and result['seconds'] > previous[result['stage']] * (1 + tolerance)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the time tracking dashboard pipeline on a synthetic ClickUp workspace.")
+    parser.add_argument('--tasks', type=int, default=2000, help="number of tasks")
+    parser.add_argument('--depth', type=int, default=3, help="levels of the task trees (1 = no subtasks)")
+    parser.add_argument('--days', type=int, default=365, help="days of time entries, up to today")
+    parser.add_argument('--entries-per-day', type=int, default=8)
+    parser.add_argument('--spaces', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every API request")
+    parser.add_argument('--rate-limit', type=int, help="requests answered per --rate-window seconds, the rest get 429 (ClickUp: 100 per minute)")
+    parser.add_argument('--rate-window', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="do not trace memory (tracemalloc slows down Python-heavy stages)")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON file saved by a previous run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown over the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    workspace = generate_workspace(tasks=args.tasks, depth=args.depth, days=args.days,
+                                   entries_per_day=args.entries_per_day, spaces=args.spaces, seed=args.seed)
+    print(f"Workspace: {len(workspace['tasks'])} tasks, {len(workspace['time_entries'])} time entries "
+          f"({time.perf_counter() - started:.1f}s to generate)")
+
+    server, api_url = start_server(workspace, latency=args.latency, rate_limit=args.rate_limit, rate_window=args.rate_window)
+    os.environ['CLICKUP_API_URL'] = api_url
+    os.environ.setdefault('CLICKUP_TEAM_ID', 'benchmark')
+    os.environ.setdefault('CLICKUP_API_KEY', 'benchmark')
+
+    stages = Stages(memory=not args.no_memory)
+    if stages.memory:
+        tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as store_dir:
+            args.store_dir = store_dir
+            run_pipeline(stages, args)
+    finally:
+        server.shutdown()
+        if stages.memory:
+            tracemalloc.stop()
+
+    with pd.option_context('display.float_format', '{:.3f}'.format, 'display.width', 200):
+        print(stages.table())
+    print("API requests:", server.clickup.requests, "rejected with 429:", server.clickup.rate_limited)
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump({'args': {key: value for key, value in vars(args).items() if key != 'store_dir'},
+                       'stages': stages.results}, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            slower = compare(stages.results, json.load(baseline_file)['stages'], args.tolerance)
+        for stage, seconds, previous in slower:
+            print(f"SLOWER: {stage}: {seconds:.3f}s (baseline {previous:.3f}s)")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import random
+import time
+
+#################################################################
+#                                                               #
+# Synthetic ClickUp workspace                                   #
+#                                                               #
+#################################################################
+# Tareas, registros de tiempo y spaces con la misma forma que las respuestas
+# de la API de ClickUp, para medir la app sin un workspace real.
+
+STATUSES = ['to do', 'in progress', 'done', 'completed']
+DAY_MS = 24 * 3600 * 1000
+
+
+def generate_workspace(tasks=2000, depth=3, days=365, entries_per_day=8, spaces=4, folders=3, lists=3, seed=0, now=None, running_timer=True):
+    """
+    Returns {'tasks': [...], 'time_entries': [...], 'spaces': [...]} as ClickUp
+    would send them.
+
+    The tasks form trees of `depth` levels (level 0 are the main tasks, each
+    task of the next level hangs from a random task of the previous one) and
+    inherit the space/folder/list of their main task. There are
+    `entries_per_day` time entries on each of the last `days` days, on random
+    tasks, without overlapping within a day. With running_timer, the last
+    entry is a timer still running, which ClickUp sends with a negative
+    duration (-start) and no end.
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = int(time.time() * 1000)
+    space_names = ['Space ' + str(number) for number in range(spaces)]
+
+    levels = [[] for _ in range(depth)]
+    raw_tasks = []
+    locations = {}
+    for number in range(tasks):
+        level = min(number * depth // tasks, depth - 1)
+        task_id = 't' + str(number)
+        if level == 0:
+            parent = None
+            space = rng.choice(space_names)
+            folder = rng.choice(['hidden'] + ['Folder ' + str(folder_number) for folder_number in range(folders)])
+            locations[task_id] = (space, folder, 'List ' + str(rng.randrange(lists)))
+        else:
+            parent = rng.choice(levels[level - 1])
+            locations[task_id] = locations[parent]
+        levels[level].append(task_id)
+        raw_tasks.append({
+            'id': task_id,
+            'name': 'Task ' + str(number),
+            'archived': False,
+            'status': {'status': rng.choice(STATUSES)},
+            'time_spent': None,
+            'parent': parent,
+            'start_date': None,
+            'due_date': str(now + rng.randrange(-30, 30) * DAY_MS),
+            'date_updated': str(now - rng.randrange(days + 1) * DAY_MS),
+        })
+
+    raw_entries = []
+    first_day = (now // DAY_MS - days + 1) * DAY_MS
+    for day in range(days):
+        # de 7:00 a 22:00 (UTC), repartido entre los registros del dia
+        slot = 15 * 3600 * 1000 // max(entries_per_day, 1)
+        start = first_day + day * DAY_MS + 7 * 3600 * 1000
+        for _ in range(entries_per_day):
+            task = rng.choice(raw_tasks)
+            duration = rng.randrange(60 * 1000, slot)
+            end = start + duration
+            if end > now:
+                break
+            space, folder, list_name = locations[task['id']]
+            raw_entries.append({
+                'id': 'e' + str(len(raw_entries)),
+                'task': {'id': task['id'], 'name': task['name'], 'status': task['status']},
+                'duration': str(duration),
+                'start': str(start),
+                'end': str(end),
+                'at': end,
+                'task_location': {
+                    'space_name': space,
+                    'folder_name': folder, # 'hidden': lista fuera de carpetas
+                    'list_name': list_name,
+                },
+            })
+            start = start + slot
+    if running_timer and raw_entries:
+        timer = raw_entries[-1]
+        timer['duration'] = str(-int(timer['start']))
+        timer['end'] = None
+    return {
+        'tasks': raw_tasks,
+        'time_entries': raw_entries,
+        'spaces': [{'id': str(number), 'name': name} for number, name in enumerate(space_names)],
+    }
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tracing import trace
+
+#################################################################
+#                                                               #
+# ClickUp API client                                            #
+#                                                               #
+#################################################################
+# Todas las peticiones a ClickUp pasan por un unico cliente con su propio event
+# loop (en un hilo aparte): las paginas y los hilos en segundo plano le mandan
+# corrutinas con run()/submit(). El transporte es la sesion de requests (con
+# keep-alive) ejecutada en un pool de hilos, asi que no hace falta aiohttp.
+
+MAX_CONCURRENT_REQUESTS = 8 # peticiones a ClickUp a la vez, entre todas las sesiones
+MAX_RETRIES = 5 # reintentos cuando ClickUp responde 429 (rate limit)
+REQUEST_TIMEOUT = 60
+
+
+def get_retry_delay(response, attempt):
+    # ClickUp indica cuando se libera el limite en X-RateLimit-Reset (epoch en segundos)
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+    reset = response.headers.get("X-RateLimit-Reset")
+    if reset is not None:
+        try:
+            return min(max(float(reset) - time.time(), 0) + 0.5, 60)
+        except ValueError:
+            pass
+    return min(2 ** attempt, 30) # backoff exponencial si no hay cabeceras
+
+
+def get_rate_limit_pause(response):
+    """Seconds to wait before the next request when the rate limit is used up, else 0."""
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    try:
+        if remaining is None or int(remaining) > 0:
+            return 0
+    except ValueError:
+        return 0
+    return get_retry_delay(response, 0)
+
+
+class ClickUpClient:
+    """
+    GET requests to the ClickUp API from any thread.
+
+    - Connection pooling: one keep-alive requests.Session.
+    - Coalescing: identical requests (path, params, headers) in flight at the
+      same time share one response. Callers must not modify the returned JSON.
+    - Rate limiting: at most max_concurrency requests at once and, after a
+      429 or when X-RateLimit-Remaining reaches 0, every request waits until
+      ClickUp releases the limit.
+    """
+
+    def __init__(self, api_url, api_key, max_concurrency=MAX_CONCURRENT_REQUESTS):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="clickup")
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = {} # {clave de la peticion: asyncio.Future}, solo se usa desde el event loop
+        self.paused_until = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="clickup-loop")
+        self.thread.start()
+
+    def run(self, coroutine):
+        """Runs coroutine on the client's event loop and returns its result. Do not call it from the loop."""
+        return self.submit(coroutine).result()
+
+    def submit(self, coroutine):
+        """Starts coroutine on the client's event loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def get(self, path, params=None, headers=None):
+        """JSON response of GET path, shared with identical requests in flight."""
+        key = (path, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())))
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.fetch(path, params, headers))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(future) # cancelar a quien espera no cancela la peticion compartida
+
+    async def fetch(self, path, params, headers):
+        request_headers = {"Authorization": self.api_key}
+        if headers:
+            request_headers.update(headers)
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.semaphore:
+                delay = self.paused_until - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                response, data = await self.loop.run_in_executor(self.executor, self.send, path, params, request_headers)
+            if response.status_code == 429 and attempt < MAX_RETRIES:
+                self.pause(get_retry_delay(response, attempt))
+                continue
+            self.pause(get_rate_limit_pause(response))
+            response.raise_for_status()
+            return data
+
+    def pause(self, seconds):
+        if seconds > 0:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def send(self, path, params, headers):
+        # en el pool de hilos: la peticion y el parseo del JSON no bloquean el event loop
+        with trace("api_get " + path.rsplit("/", 1)[-1]) as span: # bytes descargados por endpoint
+            response = self.session.get(self.api_url + path, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+            span['bytes'] = len(response.content)
+            data = response.json() if response.status_code == 200 else None
+        return response, data
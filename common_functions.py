@@ -1,106 +1,600 @@
-import streamlit as st
-import requests
 import pandas as pd
-import matplotlib.pyplot as plt
-from fpdf import FPDF
-from tempfile import NamedTemporaryFile
-import base64
-from datetime import datetime
-import io
+import numpy as np
+import asyncio
+import hashlib
+from datetime import datetime, date, timezone
+import os
+import sys
+import time
+import threading
+import weakref
+from collections import OrderedDict
+
+from tracing import traced
+from clickup_client import ClickUpClient
 
 #################################################################
 #                                                               #  
 # Access to ClickUp personal workspace (see streamlit secrets)  #
 #                                                               #
 #################################################################
-team_id = st.secrets["team_id"] #workspace personal
-API_KEY = st.secrets["API_KEY"]
+# CLICKUP_TEAM_ID / CLICKUP_API_KEY / CLICKUP_API_URL permiten apuntar a otro servidor (p.ej. benchmarks/)
+# Este modulo es la capa de datos (descarga, normalizacion y agregacion): no importa
+# Streamlit ni matplotlib/fpdf (ver rendering.py y ui.py), asi que cargarlo es rapido.
+API_URL = os.environ.get("CLICKUP_API_URL", "https://api.clickup.com/api/v2")
+TASKS_PAGE_SIZE = 100 # ClickUp devuelve como maximo 100 tareas por pagina
+FETCH_WORKERS = 4 # paginas que se piden a la vez
+WINDOW_RETRIES = 3 # reintentos de cada ventana mensual de time entries
+TASK_COLUMNS = ['id','name','archived','status','time_spent','parent','start_date','due_date']
+TIME_ENTRY_COLUMNS = ['id','task.id','task','task_status','miliseconds','start','end','at','space','folder','list']
+TIME_ENTRY_CATEGORIES = ['task.id','task','task_status','space','folder','list']
+ROLLUP_CATEGORIES = ['task.id','main_task','space','folder','list','task','task_status']
+TRACKING_START_DATE = date(2022, 10, 1) #1st of october was when I started the personal workspace
+REPORT_TIMEZONE = os.environ.get("TIME_TRACKING_TIMEZONE", 'Europe/Madrid') # zona en la que se agrupan los registros por dias
+ROLLUP_KEYS = ['day','task.id','main_task','space','folder','list']
+WORKSPACE_TTL = 3600 # segundos que se reutilizan los spaces antes de volver a pedirlos
+EXPORT_CACHE_BYTES = 64 * 1024 * 1024 # tamaño maximo de los informes PDF/XLSX generados que se guardan en memoria
+REPORT_CACHE_BYTES = 64 * 1024 * 1024 # tamaño maximo de las tablas de informes ya calculadas (ver get_report)
 
-#store all tasks in a dataframe. Se utiliza para no mostrar time entries de tareas eliminadas y tambien para obtener la Parent Task
-#@st.cache()
-def get_tasks(page):
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_secret(key):
+    # sin variables de entorno, los secrets de Streamlit (solo entonces se importa streamlit)
+    import streamlit as st
+    return st.secrets[key]
+
+
+def get_team_id():
+    """ClickUp workspace id: CLICKUP_TEAM_ID or the team_id secret."""
+    return os.environ.get("CLICKUP_TEAM_ID") or get_secret("team_id") #workspace personal
+
+
+def get_api_key():
+    """ClickUp API key: CLICKUP_API_KEY or the API_KEY secret."""
+    return os.environ.get("CLICKUP_API_KEY") or get_secret("API_KEY")
+
+
+def get_client():
+    """Returns the ClickUpClient shared by all ClickUp calls of the process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ClickUpClient(API_URL, get_api_key(), max_concurrency=FETCH_WORKERS * 2)
+    return _client
+
+
+def run_async(coroutine):
+    """Runs a coroutine of the fetch_* functions on the ClickUp client and waits for its result."""
+    return get_client().run(coroutine)
+
+
+def submit_async(coroutine):
+    """Starts a coroutine of the fetch_* functions without waiting; returns a concurrent.futures.Future."""
+    return get_client().submit(coroutine)
+
+
+def task_record(task):
+    """Picks from one raw ClickUp task the fields in TASK_COLUMNS."""
+    status = task.get('status') or {}
+    return (
+        task['id'], task.get('name'), bool(task.get('archived')), status.get('status'),
+        to_int(task.get('time_spent')), task.get('parent'), to_int(task.get('start_date')), to_int(task.get('due_date')),
+    )
+
+
+def compact_tasks(tasks):
+    """Compact dtypes for a tasks dataframe: categorical status, numeric time_spent and dates in ms."""
+    tasks['archived'] = tasks['archived'].astype(bool)
+    tasks['status'] = tasks['status'].astype('category')
+    tasks['time_spent'] = pd.to_numeric(tasks['time_spent'])
+    tasks['parent'] = tasks['parent'].astype(object).where(tasks['parent'].notna(), None) # None en las tareas principales
+    return tasks
+
+
+@traced
+def parse_tasks(raw_tasks):
+    """Selects the task columns used by the reports. Dates are kept as ClickUp ms."""
+    tasks = pd.DataFrame.from_records([task_record(task) for task in raw_tasks], columns=TASK_COLUMNS)
+    return compact_tasks(tasks)
+
+
+def convert_task_dates(tasks):
+    #procesar columna start_date y due_date para que sea una fecha y no un object
+    tasks['start_date'] = pd.to_datetime(pd.to_numeric(tasks['start_date']), unit='ms')
+    tasks['due_date'] = pd.to_datetime(pd.to_numeric(tasks['due_date']), unit='ms')
+    return tasks
+
+
+async def fetch_tasks_page(page, query=None):
+    """Raw tasks at one page of /team/{id}/task and whether it is the last page."""
     # ref: https://clickup.com/api/clickupreference/operation/GetFilteredTeamTasks/
-    url = "https://api.clickup.com/api/v2/team/" + team_id + "/task"
-    query = {
+    params = {
         "page": page,
         "reverse": "true",
         "subtasks": "true",
         "include_closed": "true",
-        "team_id": team_id
+        "team_id": get_team_id()
     }
-    headers = {"Authorization": API_KEY}
-    response = requests.get(url, headers=headers, params=query)
-    data = response.json()
-    data = data['tasks']
-    data = pd.json_normalize(data)
-    #st.table(str(data.dtypes))
-    tasks = data[['id','name','archived','status.status','time_spent','parent','start_date','due_date']]
-    tasks = tasks.rename(columns={'status.status':'status'})
-    #procesar columna id y name para que sea string y no object
-    #tasks['id'] = tasks['id'].astype('string')
-    #tasks['name'] = tasks['name'].astype('string')
-    #tasks['parent'] = tasks['parent'].astype('string')
-    #procesar columna start_date y due_date para que sea una fecha y no un object
-    tasks['start_date'] = pd.to_datetime(tasks['start_date'], unit='ms')
-    tasks['due_date'] = pd.to_datetime(tasks['due_date'], unit='ms')
-    #tasks.dtypes
-    #tasks   
-    #st.table(tasks) 
-    return tasks
+    if query:
+        params.update(query)
+    data = await get_client().get("/team/" + get_team_id() + "/task", params=params)
+    raw_tasks = data['tasks']
+    # si la respuesta no trae last_page, una pagina incompleta es la ultima
+    last_page = data.get('last_page', len(raw_tasks) < TASKS_PAGE_SIZE)
+    return raw_tasks, last_page
+
+
+async def fetch_all_tasks(query=None, max_workers=FETCH_WORKERS):
+    """
+    Raw tasks of the whole workspace (or those matching `query`).
+
+    Pages are requested concurrently, `max_workers` at a time, moving ahead
+    speculatively until a page reports `last_page`. Pages fetched beyond the
+    last one are discarded.
+    """
+    pages = {}
+    last_page = None
+    next_page = 0
+    pending = {}
+    try:
+        while True:
+            while len(pending) < max_workers and (last_page is None or next_page <= last_page):
+                pending[asyncio.ensure_future(fetch_tasks_page(next_page, query))] = next_page
+                next_page = next_page + 1
+            if not pending:
+                break
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                page = pending.pop(future)
+                try:
+                    raw_tasks, is_last = future.result()
+                except Exception:
+                    if last_page is not None and page > last_page: # pagina especulativa, no se necesita
+                        continue
+                    raise
+                pages[page] = raw_tasks
+                if is_last and (last_page is None or page < last_page):
+                    last_page = page
+    finally:
+        for future in pending:
+            future.cancel()
+    return [task for page in sorted(pages) if page <= last_page for task in pages[page]]
+
+
+@traced
+def get_tasks_page(page, query=None):
+    """Returns the tasks at one page of /team/{id}/task and whether it is the last page."""
+    raw_tasks, last_page = run_async(fetch_tasks_page(page, query))
+    return parse_tasks(raw_tasks), last_page
 
 
-def get_all_tasks():
-    result = pd.DataFrame()
-    page = 0
-    df = get_tasks(page)
-    result = pd.concat([result,df])
-    #while len(result) == 100:
-    while len(result) % 100 == 0: # resto de division es 0 si es multiplo
-        try: #si solo hay 99 entradas pero no hay dos paginas, evitar error
-            page = page + 1
-            df = get_tasks(page)
-            result = pd.concat([result,df])
-        except:
-            break
+#store all tasks in a dataframe. Se utiliza para no mostrar time entries de tareas eliminadas y tambien para obtener la Parent Task
+def get_tasks(page):
+    tasks, last_page = get_tasks_page(page)
+    return convert_task_dates(tasks)
+
+
+@traced
+def get_all_tasks(max_workers=FETCH_WORKERS, query=None, parse_dates=True):
+    """Downloads every task of the workspace (or those matching `query`), see fetch_all_tasks."""
+    result = parse_tasks(run_async(fetch_all_tasks(query, max_workers)))
+    if parse_dates:
+        result = convert_task_dates(result)
     return result
 
 
+async def fetch_spaces():
+    # ref: https://clickup.com/api/clickupreference/operation/GetSpaces/
+    data = await get_client().get("/team/" + get_team_id() + "/space", params={"archived": "false"})
+    return [[space['name']] for space in data['spaces']]
+
+
+@traced
+def get_spaces():
+    return run_async(fetch_spaces())
+
+
+async def fetch_time_entries_range(start, end):
+    """Raw time entries (list of dicts) between start and end (ms since epoch)."""
+    # ref: https://clickup.com/api/clickupreference/operation/Gettimeentrieswithinadaterange/
+    query = {
+        "start_date": start,
+        "end_date": end,
+        "include_task_tags": "true",
+        "include_location_names": "true",
+    }
+    data = await get_client().get("/team/" + get_team_id() + "/time_entries", params=query, headers={"Content-Type": "application/json"})
+    return data['data']
+
+
+@traced
+def get_time_entries_range(start, end):
+    """Returns the raw time entries (list of dicts) between start and end (ms since epoch)."""
+    return run_async(fetch_time_entries_range(start, end))
+
+
+def to_int(value):
+    if value is None or value != value: # None o NaN
+        return None
+    return int(value)
+
+
+def time_entry_record(entry):
+    """Flattens one raw ClickUp time entry into a tuple ordered as TIME_ENTRY_COLUMNS."""
+    task = entry.get('task') or {} # las tareas borradas pueden venir sin 'task'
+    status = task.get('status') or {}
+    location = entry.get('task_location') or {}
+    return (
+        entry['id'], task.get('id'), task.get('name'), status.get('status'),
+        to_int(entry.get('duration')), to_int(entry.get('start')), to_int(entry.get('end')), to_int(entry.get('at')),
+        location.get('space_name'), location.get('folder_name'), location.get('list_name'),
+    )
+
+
+def compact_time_entries(data):
+    """
+    Compact dtypes for a time entries dataframe: the repeated strings
+    (TIME_ENTRY_CATEGORIES) as categoricals and durations/timestamps as int64 ms.
+    """
+    data = data.astype({column: 'category' for column in TIME_ENTRY_CATEGORIES})
+    for column in ['miliseconds','start','end','at']:
+        data[column] = pd.to_numeric(data[column]).fillna(0).astype('int64')
+    # un timer en marcha trae duracion negativa (-start) y sin 'end': cuenta hasta ahora
+    running = data['miliseconds'] < 0
+    if running.any():
+        now = int(time.time() * 1000)
+        data.loc[running, 'miliseconds'] = (now - data.loc[running, 'start']).clip(lower=0)
+        data.loc[running, 'end'] = now
+    return data
+
+
+@traced
+def parse_time_entries(raw_entries):
+    """Raw ClickUp time entries as a dataframe with TIME_ENTRY_COLUMNS (timestamps in ms)."""
+    data = pd.DataFrame.from_records([time_entry_record(entry) for entry in raw_entries], columns=TIME_ENTRY_COLUMNS)
+    return compact_time_entries(data)
+
+
+def split_in_months(start, end):
+    """Splits [start, end] (ms since epoch) in windows that end at each UTC month boundary."""
+    windows = []
+    window_start = start
+    while window_start < end:
+        day = datetime.fromtimestamp(window_start / 1000, tz=timezone.utc)
+        next_month = datetime(day.year + day.month // 12, day.month % 12 + 1, 1, tzinfo=timezone.utc)
+        window_end = min(int(next_month.timestamp() * 1000), end)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+async def fetch_time_entries_window(start, end):
+    # cada ventana reintenta por su cuenta (los 429 ya los reintenta el cliente)
+    for attempt in range(WINDOW_RETRIES):
+        try:
+            return await fetch_time_entries_range(start, end)
+        except Exception:
+            if attempt == WINDOW_RETRIES - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+async def fetch_time_entries_chunked(start, end, max_workers=FETCH_WORKERS):
+    """
+    Raw time entries between start and end, requested in month-sized windows.
+
+    Windows are requested concurrently, `max_workers` at a time, and retried
+    independently. Returns the entries of every window that succeeded
+    (deduplicated by id) and the list of (start, end) windows that failed.
+    """
+    windows = split_in_months(start, end)
+    limit = asyncio.Semaphore(max_workers)
+
+    async def fetch_window(window_start, window_end):
+        async with limit:
+            return await fetch_time_entries_window(window_start, window_end)
+
+    results = await asyncio.gather(*[fetch_window(window_start, window_end) for window_start, window_end in windows], return_exceptions=True)
+    entries = {}
+    failed = []
+    for window, window_entries in zip(windows, results):
+        if isinstance(window_entries, Exception):
+            failed.append(window)
+            continue
+        for entry in window_entries:
+            entries[entry['id']] = entry
+    return list(entries.values()), failed
+
+
+@traced
+def get_time_entries_chunked(start, end, max_workers=FETCH_WORKERS):
+    """Fetches the raw time entries between start and end, see fetch_time_entries_chunked."""
+    return run_async(fetch_time_entries_chunked(start, end, max_workers))
+
+
+class TaskIndex:
+    """
+    Task hierarchy of one task snapshot: id->parent, id->name and id->root
+    (main task). Roots are memoized with path compression, so resolving the
+    main task of any task is O(1) once its branch has been walked.
+    """
+
+    def __init__(self, tasks):
+        tasks = tasks.drop_duplicates(subset='id')
+        ids = tasks['id'].tolist()
+        self.parents = {task_id: (parent if isinstance(parent, str) else None) for task_id, parent in zip(ids, tasks['parent'].tolist())}
+        self.names = dict(zip(ids, tasks['name'].tolist()))
+        self.statuses = dict(zip(ids, tasks['status'].tolist()))
+        self.roots = {}
+        self.root_arrays = None
+        self.finished = None
+
+    def __contains__(self, task_id):
+        return task_id in self.parents
+
+    def parent(self, task_id):
+        return self.parents.get(task_id)
+
+    def root(self, task_id):
+        """Returns the topmost ancestor of task_id that is in the snapshot."""
+        if task_id not in self.parents:
+            return task_id
+        path = []
+        current = task_id
+        while current not in self.roots:
+            path.append(current)
+            parent = self.parents[current]
+            if parent is None or parent not in self.parents or parent in path: # raiz, padre borrado o ciclo
+                root = current
+                break
+            current = parent
+        else:
+            root = self.roots[current]
+        for visited in path:
+            self.roots[visited] = root
+        return root
+
+    def root_name(self, task_id):
+        if task_id not in self.parents: #if task has been deleted
+            return 'deleted'
+        return self.names[self.root(task_id)]
+
+    def get_root_arrays(self):
+        # posiciones de los ids y, para cada posicion, la posicion de su tarea raiz
+        if self.root_arrays is None:
+            ids = pd.Index(list(self.parents.keys()))
+            parents = ids.get_indexer(list(self.parents.values())) # -1 si no tiene padre o esta borrado
+            positions = np.arange(len(ids))
+            up = np.where(parents >= 0, parents, positions)
+            for _ in range(64): # saltos de puntero: cada pasada dobla la distancia recorrida
+                next_up = up[up]
+                if np.array_equal(next_up, up):
+                    break
+                up = next_up
+            names = np.array(list(self.names.values()), dtype=object)
+            self.root_arrays = (ids, names[up])
+        return self.root_arrays
+
+    def root_names(self, task_ids):
+        """
+        Vectorized root_name over a Series of task ids.
+
+        Returns the Series of main task names (aligned with task_ids) and the
+        boolean mask of the ids that are not in the snapshot (deleted tasks).
+        """
+        ids, root_names = self.get_root_arrays()
+        positions = ids.get_indexer(task_ids)
+        deleted = positions < 0
+        names = np.where(deleted, 'deleted', root_names[positions]) if len(ids) else np.full(len(positions), 'deleted', dtype=object)
+        return pd.Series(names, index=task_ids.index, dtype=object), pd.Series(deleted, index=task_ids.index)
+
+    def finished_subtasks(self):
+        """
+        Series id->name of the finished subtasks that have no subtasks
+        themselves (leaves), the ones listed in the monthly report.
+        """
+        if self.finished is None:
+            has_children = set(parent for parent in self.parents.values() if parent is not None)
+            finished = {task_id: self.names[task_id] for task_id, parent in self.parents.items()
+                        if parent is not None and task_id not in has_children and self.statuses[task_id] in ('done', 'completed')}
+            self.finished = pd.Series(finished, dtype=object)
+        return self.finished
+
+
+_task_indexes = {}
+_task_indexes_lock = threading.Lock()
+
+
+@traced
+def get_task_index(tasks):
+    """Returns the TaskIndex of a tasks dataframe, built only once per snapshot."""
+    with _task_indexes_lock:
+        cached = _task_indexes.get(id(tasks))
+        if cached is not None and cached[0]() is tasks:
+            return cached[1]
+        index = TaskIndex(tasks)
+        key = id(tasks)
+        _task_indexes[key] = (weakref.ref(tasks, lambda ref: _task_indexes.pop(key, None)), index)
+        return index
+
+
 def get_ParentID(task_id, tasks):
-    if task_id in tasks['id'].unique().tolist():
-        parentID = tasks.loc[tasks['id'] == task_id]['parent'].values[0]
-    else:
-        parentID = None
-    return parentID
-    
-    
+    return get_task_index(tasks).parent(task_id)
+
 
 def get_GrandParentID(task_id, tasks):
-    #print("get_GrandParentID, received : " + str(task_id))
-    IDs = []
-    parentID = get_ParentID(task_id, tasks)
-    #print(parentID)
-    IDs.append(parentID)
-    while parentID != None:
-        parentID = get_ParentID(parentID, tasks)
-        IDs.append(parentID)
-    if len(IDs)>1:
-        GrandParentID = IDs[-2]
-    else:
-        GrandParentID = task_id
-    #print("get_GrandParentID, returned : " + str(GrandParentID))
-    return GrandParentID
-    
-    
+    return get_task_index(tasks).root(task_id)
+
+
 def get_GrandParentName(df,task_id, tasks):
-    #print("get_GrandParentName, received : " + str(task_id))
-    GrandParentID = get_GrandParentID(task_id, tasks)
-    #print(GrandParentID)
-    if task_id in tasks['id'].unique().tolist():
-        GrandParentName = tasks.loc[tasks['id'] == GrandParentID]['name'].values[0]
-    else: #if task has been deleted
-        GrandParentName = 'deleted'
-    #print("get_GrandParentName, returned : " + str(GrandParentName))
-    return GrandParentName
+    return get_task_index(tasks).root_name(task_id)
+
+
+@traced
+def get_main_tasks(task_ids, tasks):
+    """Main task name of every id in task_ids, plus the mask of deleted tasks."""
+    return get_task_index(tasks).root_names(task_ids)
+
+
+#################################################################
+#                                                               #
+# Dates in the report timezone                                  #
+#                                                               #
+#################################################################
+# Los registros se agrupan por dias y los periodos empiezan a medianoche en
+# REPORT_TIMEZONE. Los dias locales son timestamps sin zona a medianoche (como
+# la columna 'day' de los rollups) y los instantes, ms desde epoch.
+
+def local_now():
+    """Current time in REPORT_TIMEZONE."""
+    return pd.Timestamp.now(tz=REPORT_TIMEZONE)
+
+
+def local_today():
+    """Current local day, as a naive midnight timestamp."""
+    return local_now().tz_localize(None).normalize()
+
+
+def to_local_time(ms):
+    """Series of ms since epoch as REPORT_TIMEZONE timestamps, converted as a whole column."""
+    return pd.to_datetime(ms, unit='ms', utc=True).dt.tz_convert(REPORT_TIMEZONE)
+
+
+def to_local_day(ms):
+    """Local calendar day, as a naive midnight timestamp, of a series of ms since epoch."""
+    return to_local_time(ms).dt.tz_localize(None).dt.normalize()
+
+
+def local_day_ms(day):
+    """ms since epoch of the local midnight that starts day (a date or a naive timestamp)."""
+    # si la medianoche no existe o se repite por el cambio de hora, la primera hora valida
+    return int(pd.Timestamp(day).tz_localize(REPORT_TIMEZONE, ambiguous=True, nonexistent='shift_forward').timestamp() * 1000)
+
+
+def period_first_day(period, today=None):
+    """First local day of 'today', 'current_week', 'current_month', 'all_time' or a single date."""
+    if today is None:
+        today = local_today()
+    if period == 'today':
+        return today
+    if period == 'current_week':
+        return today - pd.Timedelta(days=today.weekday())
+    if period == 'current_month':
+        return today.replace(day=1)
+    if period == 'all_time':
+        return pd.Timestamp(TRACKING_START_DATE)
+    return pd.Timestamp(period) # datetime.date: un solo dia
+
+
+def period_bounds(period, now=None):
+    """
+    (start, end) in ms since epoch of period (see period_first_day): from its
+    first local midnight until now, or the whole day for a past date.
+    """
+    if now is None:
+        now = local_now()
+    today = now.tz_localize(None).normalize()
+    first_day = period_first_day(period, today)
+    end = int(now.timestamp() * 1000)
+    if not isinstance(period, str) and first_day < today:
+        end = local_day_ms(first_day + pd.Timedelta(days=1))
+    return local_day_ms(first_day), end
+
+
+def month_bounds(year, month, now=None):
+    """(start, end) in ms since epoch of a calendar month in REPORT_TIMEZONE, until now for the current month."""
+    if now is None:
+        now = local_now()
+    first_day = pd.Timestamp(year, month, 1)
+    end = min(local_day_ms(first_day + pd.DateOffset(months=1)), int(now.timestamp() * 1000))
+    return local_day_ms(first_day), end
+
+
+@traced
+def build_daily_rollup(entries, tasks):
+    """
+    Aggregates time entries (TIME_ENTRY_COLUMNS) per day, task and location.
+
+    One row per ROLLUP_KEYS with the summed miliseconds, the first start and
+    the last end (ms) of the day, the task name and status, and whether the
+    task has been deleted. Entries are bucketed by the local day of 'at'.
+    """
+    main_task, deleted = get_main_tasks(entries['task.id'], tasks)
+    frame = pd.DataFrame({
+        'day': to_local_day(entries['at']),
+        'task.id': entries['task.id'],
+        'main_task': main_task,
+        'space': entries['space'],
+        'folder': entries['folder'].astype(object).str.replace('hidden','-'),
+        'list': entries['list'],
+        'task': entries['task'],
+        'task_status': entries['task_status'],
+        'deleted': deleted,
+        'miliseconds': entries['miliseconds'],
+        'start': entries['start'],
+        'end': entries['end'],
+    })
+    rollup = frame.groupby(ROLLUP_KEYS, sort=False, dropna=False, observed=True).agg(
+        miliseconds=('miliseconds', 'sum'),
+        first_start=('start', 'min'),
+        last_end=('end', 'max'),
+        task=('task', 'first'),
+        task_status=('task_status', 'first'),
+        deleted=('deleted', 'first'),
+    )
+    rollup = rollup.reset_index().sort_values('day', kind='stable', ignore_index=True)
+    return compact_rollup(rollup)
+
+
+def compact_rollup(rollup):
+    return rollup.astype({column: 'category' for column in ROLLUP_CATEGORIES})
+
+
+@traced
+def extend_daily_rollup(rollup, entries, tasks, since_day):
+    """
+    Replaces the rollup rows of the days from since_day on with the rollup of
+    entries, which must hold every entry of those days. Main tasks of the
+    older rows are resolved again against tasks, in case the hierarchy changed.
+    """
+    kept = rollup[rollup['day'] < since_day]
+    new = build_daily_rollup(entries, tasks)
+    new = new[new['day'] >= since_day]
+    result = pd.concat([kept, new], ignore_index=True)
+    result['main_task'], result['deleted'] = get_main_tasks(result['task.id'], tasks)
+    return compact_rollup(result)
+
+
+def slice_rollup(rollup, start_day=None, end_day=None):
+    """Rollup rows of non-deleted tasks with start_day <= day < end_day."""
+    mask = ~rollup['deleted']
+    if start_day is not None:
+        mask = mask & (rollup['day'] >= pd.Timestamp(start_day))
+    if end_day is not None:
+        mask = mask & (rollup['day'] < pd.Timestamp(end_day))
+    return rollup[mask]
+
+
+@traced
+def build_period_report(rollup, start_day):
+    """Time by space (miliseconds and hh:mm) from start_day on, with the Total row."""
+    data = slice_rollup(rollup, start_day) # sin tareas borradas
+    grouped = data.groupby(by=['space'], observed=True)[['miliseconds']].sum()
+    grouped.loc['Total'] = grouped.sum()
+    grouped['hh:mm'] = format_hh_mm(grouped['miliseconds'])
+    return grouped[['hh:mm','miliseconds']]
+
+
+def append_total_row(df, sum_columns=['miliseconds']):
+    """
+    Adds the 'Total' row to a report: the sum of sum_columns and '-' in the
+    other columns. Categorical columns are turned into plain objects first.
+    """
+    df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+    df.loc['Total'] = pd.Series({column: (df[column].sum() if column in sum_columns else '-') for column in df.columns})
+    return df
 
 
 def get_hh_mm_from_pcg(pcg,total):
@@ -125,125 +619,183 @@ def get_hh_mm_from_ms(ms):
     sec =(totsec%3600)%60 #just for reference
     return h,m
 
-def df2report(df):
-    fig, ax = plt.subplots()
-    ax.set_axis_off()
-    the_table = ax.table(cellText=df.values, rowLabels=df.index, colLabels=df.columns)
-    the_table.auto_set_font_size(False)
-    the_table.set_fontsize(8)
-    st.pyplot(fig)
-    return fig
-    
-def create_download_link_old(val, filename):
-    b64 = base64.b64encode(val)  # val looks like b'...'
-    return f'<a href="data:application/octet-stream;base64,{b64.decode()}" download="{filename}.pdf">Download file</a>'
-
-def create_download_link(val, filename, filetype):
-    """
-    Crea un enlace de descarga para archivos PDF o Excel.
-    """
-    mime_type = "application/pdf" if filetype == "pdf" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    b64 = base64.b64encode(val).decode()  # Codifica en base64
-    return f'<a href="data:{mime_type};base64,{b64}" download="{filename}.{filetype}">Download {filetype.upper()}</a>'
-
-
-def export_xlsx(report_tables, date_selected):
-    # Crear un buffer en memoria para guardar el archivo Excel
-    output = io.BytesIO()
-
-    # Crear un archivo Excel con múltiples hojas
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        for i, table in enumerate(report_tables):
-            table.to_excel(writer, index=True, sheet_name=f'Sheet{i+1}')
-
-    # Obtener el contenido del archivo en bytes
-    processed_data = output.getvalue()
-    
-    # Generar el nombre del archivo basado en la fecha seleccionada
-    filename = f"tasks_{date_selected.strftime('%d-%m-%Y')}"    
-    
-    # Crear el enlace de descarga
-    xlsx_link = create_download_link(processed_data, filename, "xlsx")
-    
-    # Mostrar el enlace en Streamlit
-    st.markdown(xlsx_link, unsafe_allow_html=True)
-
-
-def create_pdf_report(report_figs, report_tables, date_selected):
-    pdf = FPDF(orientation = 'P', unit = 'mm', format='A4')
-    pdf.set_font("Arial", size=12)
-    if len(report_figs)>0:
-        pdf.add_page()
-    for fig in report_figs:
-        #pdf.add_page()
-        pdf.cell(0,h=20,txt = "Current month:", align = 'C', ln=2)
-        with NamedTemporaryFile(delete=False, suffix=".png") as tmpfile:
-            fig.savefig(tmpfile.name)
-            #pdf.image(tmpfile.name, 10, 10, 200, 100)
-            pdf.image(tmpfile.name, w= 200)
-    for df in report_tables:
-        pdf.set_fill_color(230)
-        pdf.add_page()
-        pdf.cell(0,h=20,txt = "Tasks at selected day: " + str(date_selected), align = 'C', ln=2)
-        pdf.set_font("Times", size=8)
-        df = df.reset_index()
-        line_height = pdf.font_size * 2.5
-        table_width = pdf.w - (2 * pdf.l_margin)
-        col_width = table_width / df.shape[1]  # distribute content evenly
-        top = pdf.y
-        x_col = 0     
-        #colocamos nombres columnas               
-        for column in df.columns: 
-            pdf.y = top
-            pdf.x = pdf.x + (x_col * col_width)
-            #pdf.multi_cell(col_width, line_height, str(column), border = 1, align = 'L', fill = True)
-            pdf.multi_cell(col_width, line_height, column, border = 1, align = 'L', fill = True)
-            x_col = x_col + 1
-        #colocamos valores df
-        x_col = 0
-        top = top + line_height # bajamos top la altura de la fila anterior con los nombres de columnas
-        
-        # ref https://github.com/PyFPDF/fpdf2/issues/91
-        line_height = pdf.font_size * 1.5 # smaller cell height for tasks
-        for row in range(df.shape[0]):
-            row_height_lines = 1
-            lines_in_row = []
-            for column in range(df.shape[1]): # determine height of highest cell
-                output = pdf.multi_cell(col_width, line_height, df.iloc[row,column], border=1, align = 'L', split_only=True)
-                lines_in_row.append(len(output))
-                if len(output) > row_height_lines:
-                    row_height_lines = len(output)
-            if top + row_height_lines > 260 or row_height_lines > 50: # si el cursor baja mucho, insertamos pagina y reseteamos el cursor a la parte superior del pdf (A4 tiene 297 mm de altura)
-                pdf.add_page()
-                top = 10
-            x_col = 0
-            for tlines,column in zip(lines_in_row,range(df.shape[1])):
-                text = df.iloc[row,column].rstrip('\n') + (1 + row_height_lines - tlines) * '\n'
-                text = text.replace(u"\u2018", "'").replace(u"\u2019", "'")
-                pdf.y = top
-                pdf.x = pdf.x + (x_col * col_width)
-                pdf.set_fill_color(245)
-                if column == (df.shape[1] - 1) or row == (df.shape[0] - 1): # fill cells in column hh:mm and row Totals
-                    pdf.multi_cell(col_width, line_height, text, border=1, align = 'L', fill = True)
-                else:
-                    pdf.multi_cell(col_width, line_height, text, border=1, align = 'L')
-
-                x_col = x_col + 1
-            x_col = 0
-            top = pdf.y
+
+def format_hh_mm(miliseconds):
+    """
+    Durations in ms (Series or array) as 'hh:mm' strings, rounded down to the
+    minute. Hours are not wrapped at 24, so totals of several days are right;
+    negative durations keep their sign and missing values are '-'.
+    """
+    # division entera sobre el valor absoluto: sin datetime ni strftime
+    values = pd.to_numeric(pd.Series(np.asarray(miliseconds).ravel()), errors='coerce').to_numpy(dtype=float)
+    if values.size == 0: # np.char.zfill no admite arrays vacios
+        formatted = np.empty(0, dtype=object)
+        return pd.Series(formatted, index=miliseconds.index) if isinstance(miliseconds, pd.Series) else formatted
+    missing = np.isnan(values)
+    hours, minutes = np.divmod((np.abs(np.where(missing, 0, values)) // 60000).astype(np.int64), 60)
+    formatted = np.char.add(np.char.zfill(hours.astype(str), 2), ':')
+    formatted = np.char.add(formatted, np.char.zfill(minutes.astype(str), 2))
+    formatted = np.where(values < 0, np.char.add('-', formatted), formatted).astype(object)
+    formatted[missing] = '-'
+    if isinstance(miliseconds, pd.Series):
+        return pd.Series(formatted, index=miliseconds.index)
+    return formatted
+
+@traced
+def filter_finished_subtasks(subtasks_ids, tasks):
+    # subtasks_ids: ids separados por comas de cada main_task. Devuelve, en una sola pasada,
+    # los nombres de las subtareas terminadas (y sin subtareas propias) separados por '; '
+    finished = get_task_index(tasks).finished_subtasks()
+    ids = pd.Series(subtasks_ids.values).str.split(',').explode()
+    names = ids.map(finished).dropna()
+    list_subtasks = names.groupby(level=0).agg(lambda x: '; '.join(set(x)))
+    list_subtasks = list_subtasks.reindex(range(len(subtasks_ids)), fill_value='')
+    return pd.Series(list_subtasks.values, index=subtasks_ids.index)
+
+
+@traced
+def build_month_report(data, report_type, tasks):
+    """
+    Monthly report table from a month of daily rollup rows (see get_rollup_month
+    in the monthly page). data is not modified.
+    """
+    space = data['space'].astype(str)
+    folder = data['folder'].astype(str)
+    location = (space + '-' + folder).where(folder != '-', space)
+    data = data.assign(**{'tasks (locations)': data['main_task'].astype(str) + ' (' + location + ')'})
+    if report_type == 'Grouped by days':
+        data = data.set_index('day')
+        grouped = data.resample('D').agg({'miliseconds':'sum','first_start':'min','last_end':'max','tasks (locations)':lambda x: '; '.join(set(x)) if len(set(x))>0 else "-"}) 
+        grouped.index = grouped.index.strftime('%d/%m/%Y')
+        grouped['start_time'] = to_local_time(grouped['first_start']).dt.strftime('%H:%M')
+        grouped['end_time'] = to_local_time(grouped['last_end']).dt.strftime('%H:%M')
+        grouped = append_total_row(grouped)
+        grouped['hh:mm'] = format_hh_mm(grouped['miliseconds'])
+        grouped = grouped.fillna('-')
+        report = grouped[['hh:mm','start_time','end_time','tasks (locations)']]
+    elif report_type == 'Grouped by tasks':
+        #procesamos
+        data = data.assign(at_date=data['day'].dt.strftime('%d'))
+        grouped = data.groupby(by=['main_task'], observed=True).agg({'miliseconds':sum, 'space':'first','folder':'first', 'list':'first','at_date':lambda x:','.join(set(x)), 'task.id': lambda x: ','.join(set(x))})
+        grouped = grouped.rename(columns={'task.id':'subtasks_id'})
+        grouped['at_date'] = grouped['at_date'].str.split(',').apply(sorted).str.join(', ')
+        grouped['subtasks_finished'] = filter_finished_subtasks(grouped['subtasks_id'], tasks)
+        merged = grouped.merge(tasks[['name','status']], left_on ='main_task', right_on ='name', how='left')
+        merged = merged.rename(columns={'name':'main_task'})
+        merged = merged.set_index('main_task')
+        merged = merged.sort_values(by=['space', 'folder', 'list', 'status','miliseconds','main_task'])
+        merged = append_total_row(merged)
+        merged['hh:mm'] = format_hh_mm(merged['miliseconds'])
+        report = merged[['status','subtasks_finished','space','folder','list','at_date','hh:mm']]   
+        report = report.fillna('-')    
         
-    # Generar el archivo PDF y el enlace de descarga
-    #try:
-    #    pdf_data = pdf.output(dest="S").encode("latin-1")
-    #except:
-    #    pdf_data = pdf.output(dest="S").encode("cp1252", "ignore")
+    return report
 
-    try:
-        pdf_data = pdf.output(dest="S")
-    except Exception as e:
-        st.error(f"Error al generar el PDF: {e}")
-        return
-
-    # Crear el enlace de descarga
-    pdf_link = create_download_link(pdf_data, "report", "pdf")
-    st.markdown(pdf_link, unsafe_allow_html=True)
+
+@traced
+def build_range_report(data, first_month, last_month):
+    """
+    Report table of the months first_month to last_month ((year, month)) from
+    their daily rollup rows, in one pivot: a row per main task with its space,
+    an hh:mm column per month (mm/YYYY), the 'Total' column and the Total row.
+    data is not modified.
+    """
+    months = pd.period_range(pd.Period(year=first_month[0], month=first_month[1], freq='M'),
+                             pd.Period(year=last_month[0], month=last_month[1], freq='M'), freq='M')
+    data = data.assign(month=data['day'].dt.to_period('M'))
+    pivot = data.pivot_table(index=['main_task','space'], columns='month', values='miliseconds', aggfunc='sum', fill_value=0, observed=True)
+    pivot = pivot.reindex(columns=months, fill_value=0) # meses sin registros a 00:00
+    pivot.columns = months.strftime('%m/%Y')
+    month_columns = list(pivot.columns) + ['Total']
+    pivot['Total'] = pivot.sum(axis=1)
+    pivot = pivot.reset_index(level='space').sort_values(by=['space','Total'], ascending=[True, False])
+    pivot = append_total_row(pivot, sum_columns=month_columns)
+    return pivot.assign(**{column: format_hh_mm(pivot[column]) for column in month_columns})
+
+
+class LruCache:
+    """
+    Thread-safe least recently used cache, limited by the total size in bytes
+    of its values (see value_size). The values are shared: do not modify them.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict() # {clave: (valor, bytes)}, los mas recientes al final
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Value under key, or None."""
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key][0]
+        return None
+
+    def put(self, key, value):
+        """Keeps value under key, dropping the least recently used values above max_bytes."""
+        size = value_size(value)
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self.items) > 1:
+                _, (_, dropped) = self.items.popitem(last=False)
+                self.size -= dropped
+
+    def get_or_build(self, key, build):
+        """Value under key, built with build() and kept the first time."""
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        return value
+
+
+def value_size(value):
+    # bytes en memoria de los valores de las caches: dataframes, series y bytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+_exports = LruCache(EXPORT_CACHE_BYTES) # {hash del contenido: bytes}
+_reports = LruCache(REPORT_CACHE_BYTES) # {(version de las tareas, periodo, tipo): dataframe}
+
+
+def report_hash(*parts):
+    """sha256 of the content of a report: dataframes, bytes and plain values."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            digest.update(repr(list(part.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(part.astype(str), index=True).values.tobytes())
+        elif isinstance(part, (bytes, bytearray)):
+            digest.update(part)
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def get_cached_export(key):
+    return _exports.get(key)
+
+
+def cache_export(key, data):
+    """Keeps data under key, dropping the least recently used exports above EXPORT_CACHE_BYTES."""
+    _exports.put(key, data)
+
+
+def get_report(key, build):
+    """
+    Report table built by build(), kept by key: a tuple with the version of
+    the data snapshot, the period (or year and month) and the report type.
+    Reports of old versions are dropped as the newer ones fill REPORT_CACHE_BYTES.
+    """
+    return _reports.get_or_build(key, build)
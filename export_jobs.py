@@ -0,0 +1,231 @@
+import io
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import streamlit as st
+
+from common_functions import (
+    report_hash,
+    get_cached_export,
+    cache_export,
+)
+from rendering import (
+    PDF_FIGURE_FORMAT,
+    PDF_FIGURE_DPI,
+    figure_buffer,
+    build_pdf_report,
+    build_xlsx_report,
+)
+from local_store import get_store_path
+from batch_reports import month_pdf
+from ui import offer_download
+
+#################################################################
+#                                                               #
+# Background PDF/XLSX exports                                   #
+#                                                               #
+#################################################################
+# Los informes se generan en un pool de hilos (o de procesos para los lotes)
+# y el resultado se guarda en la cache de exportaciones de common_functions,
+# limitada por tamaño: el script de Streamlit solo encola y muestra el progreso.
+
+EXPORT_WORKERS = 2 # informes que se generan a la vez en segundo plano
+BATCH_PROCESSES = min(4, os.cpu_count() or 1) # procesos para los lotes de informes
+EXPORT_JOBS_KEPT = 50 # trabajos terminados que se recuerdan en el proceso
+EXPORT_JOBS_SHOWN = 5 # trabajos que se muestran en cada sesion
+EXPORT_POLL_SECONDS = 1
+
+
+class ExportJob:
+    """One report being generated. The bytes live in the export cache under key."""
+
+    def __init__(self, label, filename, filetype, key):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.filename = filename
+        self.filetype = filetype
+        self.key = key
+        self.status = 'queued' # queued, running, done, failed
+        self.progress = 0.0
+        self.error = None
+        self.created = time.time()
+
+    def set_progress(self, fraction):
+        self.progress = fraction
+
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def get_data(self):
+        """The generated file, or None if it was dropped from the export cache."""
+        return get_cached_export(self.key)
+
+
+class ExportQueue:
+    """
+    Runs report builds in a pool of worker threads; batches of reports are
+    built in worker processes. Jobs are shared by all the sessions of the
+    process, so the same report requested twice is only built once.
+    """
+
+    def __init__(self, workers=EXPORT_WORKERS, processes=BATCH_PROCESSES):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        self.processes = processes
+        self.process_pool = None
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict() # {id: ExportJob}, los mas recientes al final
+
+    def submit(self, label, filename, filetype, key, build):
+        """
+        Queues build(progress) -> bytes, where progress is called with the
+        fraction done. If the report is cached or already queued, no new
+        build is started.
+        """
+        with self.lock:
+            for job in self.jobs.values():
+                if job.key == key and job.status in ('queued', 'running'):
+                    return job
+            job = ExportJob(label, filename, filetype, key)
+            self.jobs[job.id] = job
+            self.drop_old_jobs()
+        if get_cached_export(key) is not None:
+            job.progress = 1.0
+            job.status = 'done'
+        else:
+            self.executor.submit(self.run, job, build)
+        return job
+
+    def run(self, job, build):
+        job.status = 'running'
+        try:
+            cache_export(job.key, build(job.set_progress))
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            job.error = e
+            job.status = 'failed'
+
+    def drop_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished()]
+        for job_id in finished[:max(0, len(finished) - EXPORT_JOBS_KEPT)]:
+            del self.jobs[job_id]
+
+    def get_jobs(self, job_ids):
+        with self.lock:
+            return [self.jobs[job_id] for job_id in job_ids if job_id in self.jobs]
+
+    def get_process_pool(self):
+        with self.lock:
+            if self.process_pool is None:
+                # spawn: el proceso de Streamlit tiene hilos en marcha y fork no es seguro
+                self.process_pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+            return self.process_pool
+
+    def submit_batch(self, label, filename, key, function, items):
+        """
+        Queues a zip file with one file per (name, args) in items, built as
+        function(*args) in the worker processes. function must be a module
+        level function returning bytes, or None to leave the file out.
+        """
+        def build(progress):
+            pool = self.get_process_pool()
+            futures = {pool.submit(function, *args): name for name, args in items}
+            output = io.BytesIO()
+            with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for number, future in enumerate(as_completed(futures), 1):
+                    data = future.result()
+                    if data is not None:
+                        archive.writestr(futures[future], data)
+                    progress(number / len(futures))
+            return output.getvalue()
+
+        return self.submit(label, filename, 'zip', key, build)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_export_queue():
+    """Returns the process-wide ExportQueue."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ExportQueue()
+    return _queue
+
+
+def track_job(job):
+    # trabajos de esta sesion, los mas recientes al final
+    job_ids = [job_id for job_id in st.session_state.get('export_jobs', []) if job_id != job.id]
+    st.session_state['export_jobs'] = (job_ids + [job.id])[-EXPORT_JOBS_SHOWN:]
+
+
+def create_pdf_report(report_figs, report_tables, date_selected, table_title=None, figure_format=PDF_FIGURE_FORMAT, figure_dpi=PDF_FIGURE_DPI):
+    if table_title is None:
+        table_title = "Tasks at selected day: " + str(date_selected)
+    # report_figs: graficos ya renderizados (bytes, ver pie_chart_image) o figuras de matplotlib,
+    # que se renderizan aqui porque matplotlib no es thread-safe; el PDF se genera en segundo plano
+    figure_buffers = [fig if isinstance(fig, bytes) else figure_buffer(fig, figure_format, figure_dpi).getvalue() for fig in report_figs]
+    key = report_hash('pdf', table_title, *figure_buffers, *report_tables)
+    job = get_export_queue().submit(
+        "PDF report", "report", "pdf", key,
+        lambda progress: build_pdf_report(figure_buffers, report_tables, table_title, progress),
+    )
+    track_job(job)
+
+
+def export_xlsx(report_tables, date_selected):
+    # Generar el nombre del archivo basado en la fecha seleccionada
+    filename = f"tasks_{date_selected.strftime('%d-%m-%Y')}"
+    key = report_hash('xlsx', *report_tables)
+    job = get_export_queue().submit("XLSX report", filename, "xlsx", key, lambda progress: build_xlsx_report(report_tables))
+    track_job(job)
+
+
+def export_months_pdf(year, months, report_type, tasks_version):
+    """Queues the monthly reports of the given months as a zip of PDF files, built in parallel processes."""
+    # la ruta del almacen se resuelve aqui: los procesos no tienen acceso a st.secrets
+    path = get_store_path()
+    items = [("report_" + str(year) + "-" + f"{month:02}" + ".pdf", (year, month, report_type, path)) for month in months]
+    key = report_hash('batch', tasks_version, items)
+    job = get_export_queue().submit_batch("PDF reports " + str(year) + " (" + report_type + ")", "reports_" + str(year), key, month_pdf, items)
+    track_job(job)
+
+
+def show_job(job):
+    if job.status == 'failed':
+        st.error(f"Error al generar {job.label}: {job.error}")
+    elif job.status != 'done':
+        st.progress(job.progress, text=job.label + ": " + ("en cola" if job.status == 'queued' else "generando..."))
+    else:
+        data = job.get_data()
+        if data is None:
+            st.info(job.label + ": el fichero ya no esta en memoria, vuelve a exportarlo.")
+        else:
+            st.write(job.label)
+            offer_download(data, job.filename, job.filetype, key=job.id)
+
+
+def show_export_jobs():
+    """Progress and download buttons of this session's exports; refreshes itself until they finish."""
+    job_ids = st.session_state.get('export_jobs', [])
+    jobs = get_export_queue().get_jobs(job_ids)
+    if len(jobs) == 0:
+        return
+    pending = any(not job.finished() for job in jobs)
+
+    def show_jobs():
+        current = get_export_queue().get_jobs(job_ids)
+        for job in reversed(current):
+            show_job(job)
+        if pending and all(job.finished() for job in current):
+            st.rerun() # deja de refrescar
+
+    st.fragment(show_jobs, run_every=EXPORT_POLL_SECONDS if pending else None)()
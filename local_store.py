@@ -0,0 +1,443 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from tracing import traced
+from common_functions import (
+    get_team_id,
+    TRACKING_START_DATE,
+    local_day_ms,
+    to_local_day,
+    local_today,
+    month_bounds,
+    split_in_months,
+    run_async,
+    fetch_all_tasks,
+    fetch_time_entries_chunked,
+    parse_tasks,
+    to_int,
+    time_entry_record,
+    compact_tasks,
+    compact_time_entries,
+    build_daily_rollup,
+    extend_daily_rollup,
+    slice_rollup,
+    build_month_report,
+    get_task_index,
+)
+
+logger = logging.getLogger("time_tracking.sync")
+
+#################################################################
+#                                                               #
+# Local copy of the ClickUp tasks and time entries (SQLite)     #
+#                                                               #
+#################################################################
+# Las paginas leen de aqui; sync_store() solo pide a ClickUp lo que ha cambiado
+# desde la ultima sincronizacion, asi que el coste no crece con el historico. Una
+# vez al dia se reemplazan ademas las tareas y los ultimos RECONCILE_MONTHS de
+# registros de tiempo, para recoger lo que el filtro incremental no ve.
+
+CACHE_DIR = os.environ.get(
+    "TIME_TRACKING_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "time_tracking_dashboard"),
+)
+FULL_SYNC_INTERVAL_MS = 24 * 3600 * 1000 # descarga completa de tareas una vez al dia (detecta tareas borradas)
+SYNC_OVERLAP_MS = 24 * 3600 * 1000 # margen para recoger entradas editadas o timers que seguian en marcha
+RECONCILE_INTERVAL_MS = 24 * 3600 * 1000 # una vez al dia se vuelven a descargar enteros los ultimos meses
+RECONCILE_MONTHS = 3 # meses que se reemplazan: recoge entradas añadidas a dias pasados, editadas o borradas
+SNAPSHOT_REFRESH_SECONDS = 600 # cada cuanto se sincroniza en segundo plano la copia compartida de tareas
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    archived INTEGER,
+    status TEXT,
+    time_spent INTEGER,
+    parent TEXT,
+    start_date INTEGER,
+    due_date INTEGER
+);
+CREATE TABLE IF NOT EXISTS time_entries (
+    id TEXT PRIMARY KEY,
+    task_id TEXT,
+    task_name TEXT,
+    task_status TEXT,
+    duration INTEGER,
+    start INTEGER,
+    "end" INTEGER,
+    at INTEGER,
+    space TEXT,
+    folder TEXT,
+    list TEXT
+);
+CREATE INDEX IF NOT EXISTS time_entries_start ON time_entries (start);
+CREATE INDEX IF NOT EXISTS time_entries_at ON time_entries (at);
+CREATE TABLE IF NOT EXISTS failed_windows (
+    start INTEGER,
+    "end" INTEGER,
+    PRIMARY KEY (start, "end")
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+def get_store_path():
+    return os.path.join(CACHE_DIR, "clickup_" + str(get_team_id()) + ".sqlite3")
+
+
+def connect(path=None):
+    if path is None:
+        path = get_store_path()
+        os.makedirs(CACHE_DIR, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def get_meta(connection, key):
+    row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(connection, key, value):
+    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def get_task_query(connection, sync_started, full=False):
+    """
+    (full, query) of the next task sync: every task once a day (so deleted
+    tasks disappear), otherwise only those updated since the last sync.
+    """
+    last_sync = get_meta(connection, 'tasks_synced_at')
+    last_full_sync = get_meta(connection, 'tasks_full_synced_at')
+    if last_sync is None or last_full_sync is None or sync_started - last_full_sync > FULL_SYNC_INTERVAL_MS:
+        full = True
+    if full:
+        return True, None
+    return False, {"date_updated_gt": last_sync - SYNC_OVERLAP_MS}
+
+
+def get_entry_ranges(connection, sync_started, full=False):
+    """
+    (ranges, reconcile) of the next time entry sync. ranges are the (start,
+    end) ranges to download: those newer than the newest stored `at`, plus
+    the windows that failed in previous syncs. reconcile is the range whose
+    stored entries are replaced by the downloaded ones (the whole history on
+    the first or a full sync, the last RECONCILE_MONTHS once a day), or None.
+    """
+    newest_at = connection.execute("SELECT MAX(at) FROM time_entries").fetchone()[0]
+    last_reconcile = get_meta(connection, 'time_entries_reconciled_at')
+    reconcile = None
+    if newest_at is None or full:
+        reconcile = (local_day_ms(TRACKING_START_DATE), sync_started)
+    elif last_reconcile is None or sync_started - last_reconcile > RECONCILE_INTERVAL_MS:
+        first_day = local_today().replace(day=1) - pd.DateOffset(months=RECONCILE_MONTHS - 1)
+        reconcile = (local_day_ms(first_day), sync_started)
+    if reconcile is None:
+        ranges = [(newest_at - SYNC_OVERLAP_MS, sync_started)]
+    else:
+        ranges = [reconcile]
+        if newest_at is not None and newest_at - SYNC_OVERLAP_MS < reconcile[0]: # sin registros en los ultimos meses
+            ranges.append((newest_at - SYNC_OVERLAP_MS, reconcile[0]))
+    pending = connection.execute('SELECT start, "end" FROM failed_windows').fetchall()
+    return ranges + [tuple(window) for window in pending], reconcile
+
+
+async def fetch_time_entry_ranges(ranges):
+    """Raw time entries of every range (deduplicated by id) and the windows that failed."""
+    results = await asyncio.gather(*[fetch_time_entries_chunked(start, end) for start, end in ranges])
+    entries = {}
+    failed = []
+    for range_entries, range_failed in results:
+        for entry in range_entries:
+            entries[entry['id']] = entry
+        failed = failed + range_failed
+    return list(entries.values()), failed
+
+
+async def fetch_changes(task_query, entry_ranges):
+    # tareas y registros de tiempo se piden a ClickUp a la vez
+    return await asyncio.gather(fetch_all_tasks(task_query), fetch_time_entry_ranges(entry_ranges))
+
+
+@traced
+def store_tasks(connection, raw_tasks, full, sync_started):
+    """Stores the downloaded tasks (replacing all of them on a full sync). Returns how many were received."""
+    tasks = parse_tasks(raw_tasks)
+    rows = [
+        (row.id, row.name, to_int(row.archived), row.status, to_int(row.time_spent), row.parent,
+         to_int(row.start_date), to_int(row.due_date))
+        for row in tasks.itertuples(index=False)
+    ]
+    with connection:
+        if full:
+            connection.execute("DELETE FROM tasks")
+        connection.executemany("INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        set_meta(connection, 'tasks_synced_at', sync_started)
+        if full:
+            set_meta(connection, 'tasks_full_synced_at', sync_started)
+    return len(rows)
+
+
+@traced
+def store_time_entries(connection, entries, failed, reconcile=None, changed_from=None):
+    """
+    Stores the downloaded time entries and the windows that failed; they are
+    retried on the next sync. With reconcile, the stored entries that start
+    in that range are deleted first (except in the windows that failed), so
+    entries deleted or moved in ClickUp disappear, as in a full task sync.
+    changed_from (ms) is the earliest start this sync may have changed.
+    """
+    rows = [time_entry_record(entry) for entry in entries]
+    with connection:
+        if reconcile is not None:
+            # mismas ventanas que fetch_time_entries_chunked; ClickUp filtra por el inicio de cada entrada
+            replaced = [window for window in split_in_months(*reconcile) if window not in failed]
+            connection.executemany("DELETE FROM time_entries WHERE start >= ? AND start < ?", replaced)
+            set_meta(connection, 'time_entries_reconciled_at', reconcile[1])
+        connection.executemany("INSERT OR REPLACE INTO time_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.execute("DELETE FROM failed_windows")
+        connection.executemany('INSERT OR REPLACE INTO failed_windows (start, "end") VALUES (?, ?)', failed)
+        if changed_from is not None:
+            set_meta(connection, 'time_entries_changed_from', changed_from)
+        set_meta(connection, 'time_entries_synced_at', now_ms())
+    return len(rows)
+
+
+@traced
+def sync_store(full=False, path=None):
+    """Brings the local store up to date with ClickUp. Returns the time entry windows that failed."""
+    connection = connect(path)
+    try:
+        sync_started = now_ms()
+        entry_ranges, reconcile = get_entry_ranges(connection, sync_started, full)
+        full, task_query = get_task_query(connection, sync_started, full)
+        raw_tasks, (entries, failed) = run_async(fetch_changes(task_query, entry_ranges))
+        store_tasks(connection, raw_tasks, full, sync_started)
+        # los rangos incluyen la reconciliacion y las ventanas reintentadas
+        changed_from = min(start for start, _ in entry_ranges)
+        store_time_entries(connection, entries, failed, reconcile, changed_from)
+        return failed
+    finally:
+        connection.close()
+
+
+def get_entry_changes(path=None):
+    """
+    (synced_at, changed_from) of the last time entry sync: when it finished
+    and the earliest start (ms) it may have changed. None before the first sync.
+    """
+    connection = connect(path)
+    try:
+        return get_meta(connection, 'time_entries_synced_at'), get_meta(connection, 'time_entries_changed_from')
+    finally:
+        connection.close()
+
+
+@traced
+def load_tasks(path=None):
+    """Returns the stored tasks with the same columns and types as get_all_tasks()."""
+    connection = connect(path)
+    try:
+        tasks = pd.read_sql_query("SELECT * FROM tasks", connection)
+    finally:
+        connection.close()
+    tasks = compact_tasks(tasks)
+    tasks['start_date'] = pd.to_datetime(tasks['start_date'], unit='ms')
+    tasks['due_date'] = pd.to_datetime(tasks['due_date'], unit='ms')
+    return tasks
+
+
+@traced
+def load_time_entries(start=None, end=None, path=None, at_from=None, at_to=None):
+    """
+    Returns the stored time entries started between start and end (ms since
+    epoch) and/or with at_from <= at < at_to.
+
+    Columns: TIME_ENTRY_COLUMNS (id, task.id, task, task_status, miliseconds,
+    start, end, at, space, folder, list). Timestamps are kept in ms, each page
+    converts them as it needs.
+    """
+    query = 'SELECT id, task_id, task_name, task_status, duration, start, "end", at, space, folder, list FROM time_entries'
+    conditions = ["task_id IS NOT NULL"] # registros de tareas borradas
+    params = []
+    if start is not None:
+        conditions.append("start >= ?")
+        params.append(int(start))
+    if end is not None:
+        conditions.append("start <= ?")
+        params.append(int(end))
+    if at_from is not None:
+        conditions.append("at >= ?")
+        params.append(int(at_from))
+    if at_to is not None:
+        conditions.append("at < ?")
+        params.append(int(at_to))
+    query = query + " WHERE " + " AND ".join(conditions)
+    query = query + " ORDER BY start"
+    connection = connect(path)
+    try:
+        data = pd.read_sql_query(query, connection, params=params)
+    finally:
+        connection.close()
+    data = data.rename(columns={'task_id':'task.id','task_name':'task','duration':'miliseconds'})
+    return compact_time_entries(data)
+
+
+@traced
+def load_daily_rollup(tasks, rollup=None, since_day=None, path=None):
+    """
+    Builds the daily rollup (see build_daily_rollup) from the store. If a
+    previous rollup and since_day are given, only the entries of the days
+    from since_day on are read again and those days replaced.
+    """
+    if rollup is None or since_day is None or len(rollup) == 0:
+        return build_daily_rollup(load_time_entries(path=path), tasks)
+    return extend_daily_rollup(rollup, load_time_entries(path=path, at_from=local_day_ms(since_day)), tasks, since_day)
+
+
+@traced
+def load_month_rollup(year, month, tasks, path=None):
+    """Daily rollup of a single month, reading from the store only that month's entries."""
+    return load_months_rollup((year, month), (year, month), tasks, path)
+
+
+@traced
+def load_months_rollup(first_month, last_month, tasks, path=None):
+    """Daily rollup of the months first_month to last_month ((year, month)), in a single read of the store."""
+    at_from = month_bounds(*first_month)[0]
+    at_to = month_bounds(*last_month)[1]
+    return build_daily_rollup(load_time_entries(path=path, at_from=at_from, at_to=at_to), tasks)
+
+
+@traced
+def month_report(year, month, report_type, path=None):
+    """
+    Monthly report table of month/year, or None without time entries.
+    Used by the batch worker processes; reads the store without syncing.
+    """
+    tasks = load_tasks(path)
+    data = slice_rollup(load_month_rollup(year, month, tasks, path))
+    if len(data) == 0:
+        return None
+    return build_month_report(data, report_type, tasks)
+
+
+class TaskSnapshot:
+    """
+    Read-only tasks dataframe and daily rollup shared by every session and
+    page of the process.
+
+    The first get() syncs the store and loads the tasks; afterwards get()
+    returns at once and, when the snapshot is older than refresh_interval,
+    starts a background sync. A refresh builds a new dataframe and its
+    TaskIndex, extends the daily rollup from the first day the sync touched,
+    and swaps them in with their version number, so readers never see a
+    half-loaded snapshot. Never mutate the returned dataframes.
+    """
+
+    def __init__(self, refresh_interval=SNAPSHOT_REFRESH_SECONDS, path=None):
+        self.refresh_interval = refresh_interval
+        self.path = path
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.current = (None, 0, None) # (tasks, version, rollup), se reemplaza de una vez
+        self.synced_at = None # time_entries_synced_at con el que se construyo el rollup
+        self.loaded_at = 0
+        self.failed_windows = []
+        self.error = None
+        self.background = None
+
+    def is_loaded(self):
+        return self.current[0] is not None
+
+    def get(self):
+        """Returns (tasks, version)."""
+        return self.get_current()[:2]
+
+    def get_rollup(self):
+        """Returns (daily rollup, version): the rollup of the whole store (see load_daily_rollup)."""
+        current = self.get_current()
+        return current[2], current[1]
+
+    def get_current(self):
+        tasks, version, _ = self.current
+        if tasks is None:
+            self.refresh(if_version=version)
+        elif time.time() - self.loaded_at > self.refresh_interval:
+            self.refresh_in_background()
+        return self.current
+
+    def refresh(self, sync=True, if_version=None):
+        """
+        Syncs the store (unless sync is False) and swaps in a new tasks
+        snapshot. With if_version, nothing is done if another thread already
+        replaced that version while this one was waiting.
+        """
+        with self.refresh_lock:
+            if if_version is not None and self.current[1] != if_version:
+                return self.current[:2]
+            synced_before, _ = get_entry_changes(self.path)
+            if sync:
+                self.failed_windows = sync_store(path=self.path)
+            synced_at, changed_from = get_entry_changes(self.path)
+            tasks = load_tasks(self.path)
+            get_task_index(tasks) # el indice y el rollup se construyen una vez, fuera de las sesiones
+            rollup = self.current[2]
+            if rollup is None or len(rollup) == 0 or synced_before != self.synced_at:
+                since_day = None # primera carga, o el almacen lo sincronizo otro proceso: rollup completo
+            elif synced_at == synced_before:
+                since_day = rollup['day'].max() - pd.Timedelta(days=1) # sin sincronizar: timers en marcha
+            else:
+                since_day = to_local_day(pd.Series([changed_from])).iloc[0]
+            rollup = load_daily_rollup(tasks, rollup, since_day, self.path)
+            with self.lock:
+                self.current = (tasks, self.current[1] + 1, rollup)
+                self.synced_at = synced_at
+                self.loaded_at = time.time()
+                self.error = None
+        return self.current[:2]
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.background is not None and self.background.is_alive():
+                return
+            self.loaded_at = time.time() # no lanzar otro hilo mientras tanto
+            self.background = threading.Thread(target=self.background_refresh, daemon=True)
+            self.background.start()
+
+    def background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e: # se sigue sirviendo la copia anterior
+            logger.exception("Background refresh of the task snapshot failed")
+            with self.lock:
+                self.error = e
+                self.loaded_at = 0 # la siguiente lectura vuelve a intentarlo
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_task_snapshot():
+    """Returns the process-wide TaskSnapshot."""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = TaskSnapshot()
+    return _snapshot
@@ -0,0 +1,248 @@
+import io
+import sys
+import threading
+
+import pandas as pd
+
+from tracing import traced
+from common_functions import LruCache, get_hh_mm_from_pcg, get_hh_mm_from_ms
+
+#################################################################
+#                                                               #
+# Rendering: charts, PDF and XLSX files                         #
+#                                                               #
+#################################################################
+# matplotlib y fpdf tardan en importarse, asi que se importan dentro de las
+# funciones que los usan: las paginas y los procesos que no dibujan no los cargan.
+
+CHART_STYLE = 'ggplot'
+PDF_FIGURE_FORMAT = 'png' # 'png' o 'svg' (vectorial) para los graficos del PDF
+PDF_FIGURE_DPI = 150
+CHART_CACHE_BYTES = 16 * 1024 * 1024 # graficos ya renderizados que se guardan en memoria
+PDF_PROGRESS_ROWS = 100 # cada cuantas filas de tabla se informa del progreso del PDF
+
+_charts = LruCache(CHART_CACHE_BYTES) # {(periodo, serie, colores, formato, dpi): bytes}
+_style_loaded = False
+_style_lock = threading.Lock()
+
+
+def use_chart_style():
+    """Imports matplotlib and applies CHART_STYLE, once per process."""
+    global _style_loaded
+    with _style_lock:
+        if not _style_loaded:
+            import matplotlib.style
+            matplotlib.style.use([CHART_STYLE])
+            _style_loaded = True
+
+
+def get_palette():
+    """Colors of CHART_STYLE, in order."""
+    use_chart_style()
+    import matplotlib
+    return matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+
+
+def pie_chart(df, colors=None):
+    """Donut chart of df (miliseconds by label) with the hh:mm of each slice and the total in the centre."""
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Circle
+    use_chart_style()
+    # Figure() en vez de plt.subplots(): pyplot no guarda una referencia a cada grafico
+    fig = Figure()
+    ax = fig.subplots()
+    x = df.values
+    explode = [0.05] * len(x)
+    total_time = sum(x)
+    labels = df.index.tolist()
+    ax.pie(x, labels = labels, colors = None if colors is None else [colors[key] for key in labels], autopct=lambda pcg: get_hh_mm_from_pcg(pcg, total_time), pctdistance=0.72, explode=explode)
+    centre_circle = Circle((0, 0), 0.50, fc='white', label='anotate')
+    ax.add_artist(centre_circle)
+    hours, minutes = get_hh_mm_from_ms(total_time)
+    ax.text(0, 0, 'Total = ' + str(hours) + ':' + f"{minutes:02}", ha='center')
+    return fig
+
+
+def render_figure(fig, figure_format=PDF_FIGURE_FORMAT, figure_dpi=PDF_FIGURE_DPI):
+    """fig rendered to bytes. The figure is closed afterwards if pyplot created it."""
+    try:
+        return figure_buffer(fig, figure_format, figure_dpi).getvalue()
+    finally:
+        pyplot = sys.modules.get('matplotlib.pyplot') # sin importar pyplot si nadie lo ha hecho
+        if pyplot is not None:
+            pyplot.close(fig)
+
+
+@traced
+def pie_chart_image(df, period, colors=None, figure_format=PDF_FIGURE_FORMAT, figure_dpi=PDF_FIGURE_DPI):
+    # se renderiza una vez por serie y periodo; los mismos bytes se muestran en pantalla y van al PDF
+    key = (period, tuple(df.index), tuple(df.tolist()), tuple(sorted((colors or {}).items())), figure_format, figure_dpi)
+    return _charts.get_or_build(key, lambda: render_figure(pie_chart(df, colors), figure_format, figure_dpi))
+
+
+@traced
+def build_xlsx_report(report_tables):
+    """Excel file (bytes) with one sheet per report table."""
+    # Crear un buffer en memoria para guardar el archivo Excel
+    output = io.BytesIO()
+
+    # Crear un archivo Excel con múltiples hojas
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer: # pandas importa xlsxwriter aqui
+        for i, table in enumerate(report_tables):
+            table.to_excel(writer, index=True, sheet_name=f'Sheet{i+1}')
+
+    # Obtener el contenido del archivo en bytes
+    return output.getvalue()
+
+
+def pdf_text(value):
+    # las fuentes base de FPDF solo admiten latin-1
+    text = str(value).rstrip('\n').replace(u"\u2018", "'").replace(u"\u2019", "'")
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+
+class PdfTextWrapper:
+    """
+    Splits cell texts in lines that fit a column width, measuring every word
+    only once per font (FPDF.get_string_width is slow compared to the rest).
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.widths = {} # {(familia, estilo, tamaño): {palabra: ancho}}
+
+    def width(self, text):
+        pdf = self.pdf
+        font_widths = self.widths.setdefault((pdf.font_family, pdf.font_style, pdf.font_size_pt), {})
+        width = font_widths.get(text)
+        if width is None:
+            width = pdf.get_string_width(text)
+            font_widths[text] = width
+        return width
+
+    def wrap(self, text, max_width):
+        lines = []
+        space = self.width(' ')
+        for paragraph in text.split('\n'):
+            line = ''
+            line_width = 0
+            for word in paragraph.split(' '):
+                word_width = self.width(word)
+                if word_width > max_width: # palabra mas larga que la columna: se parte por caracteres
+                    if line:
+                        lines.append(line)
+                    line, line_width = '', 0
+                    for char in word:
+                        char_width = self.width(char)
+                        if line and line_width + char_width > max_width:
+                            lines.append(line)
+                            line, line_width = '', 0
+                        line = line + char
+                        line_width = line_width + char_width
+                elif not line:
+                    line, line_width = word, word_width
+                elif line_width + space + word_width <= max_width:
+                    line = line + ' ' + word
+                    line_width = line_width + space + word_width
+                else:
+                    lines.append(line)
+                    line, line_width = word, word_width
+            lines.append(line)
+        return lines
+
+
+def render_pdf_table(pdf, df, on_row=None):
+    """
+    Draws df as a table with evenly distributed columns, adding pages as
+    needed. The last column and the last row (Total) are shaded. on_row, if
+    given, is called with the number of rows drawn every PDF_PROGRESS_ROWS rows.
+
+    Each cell is wrapped once and drawn as a bordered rectangle plus its
+    lines of text; rows are read as plain tuples.
+    """
+    wrapper = PdfTextWrapper(pdf)
+    table_width = pdf.w - (2 * pdf.l_margin)
+    col_width = table_width / df.shape[1]  # distribute content evenly
+    text_width = col_width - 2 * pdf.c_margin
+    page_bottom = pdf.h - pdf.b_margin
+    last_column = df.shape[1] - 1
+    last_row = df.shape[0] - 1
+
+    def draw_row(cells, line_height, fill_color, fill_columns):
+        wrapped = [wrapper.wrap(pdf_text(cell), text_width) for cell in cells]
+        row_lines = max(len(lines) for lines in wrapped)
+        baseline = .5 * line_height + .3 * pdf.font_size
+        first = 0
+        while first < row_lines: # una fila mas alta que la pagina continua en la siguiente
+            top = pdf.y
+            fit = int((page_bottom - top) // line_height)
+            if fit <= 0 or (first == 0 and fit < row_lines and top > pdf.t_margin + line_height):
+                pdf.add_page()
+                continue
+            last = min(row_lines, first + fit)
+            height = (last - first) * line_height
+            pdf.set_fill_color(fill_color)
+            for column, lines in enumerate(wrapped):
+                x = pdf.l_margin + column * col_width
+                pdf.rect(x, top, col_width, height, style='DF' if fill_columns(column) else 'D')
+                for number, line in enumerate(lines[first:last]):
+                    if line: # text() es mucho mas ligero que cell(); misma linea base que cell()
+                        pdf.text(x + pdf.c_margin, top + number * line_height + baseline, line)
+            pdf.set_xy(pdf.l_margin, top + height)
+            first = last
+
+    #colocamos nombres columnas
+    draw_row(df.columns, pdf.font_size * 2.5, 230, lambda column: True)
+    #colocamos valores df
+    line_height = pdf.font_size * 1.5 # smaller cell height for tasks
+    for number, row in enumerate(df.itertuples(index=False, name=None)):
+        totals = number == last_row
+        draw_row(row, line_height, 245, lambda column: totals or column == last_column) # fill cells in column hh:mm and row Totals
+        if on_row is not None and number % PDF_PROGRESS_ROWS == 0:
+            on_row(number)
+
+
+def figure_buffer(fig, figure_format=PDF_FIGURE_FORMAT, figure_dpi=PDF_FIGURE_DPI):
+    # la figura se renderiza en memoria, sin ficheros temporales ('svg' la inserta como vectorial)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=figure_format, dpi=figure_dpi)
+    buffer.seek(0)
+    return buffer
+
+
+@traced
+def build_pdf_report(figure_buffers, report_tables, table_title, progress=None):
+    """
+    PDF file (bytes) with the rendered figures on the first page and one table
+    per page after. progress, if given, is called with the fraction done (0-1).
+    """
+    total = len(figure_buffers) + sum(len(df) for df in report_tables) + 1 # +1: pdf.output()
+    done = 0
+
+    def report(count):
+        if progress is not None:
+            progress(min(count / total, 1.0))
+
+    from fpdf import FPDF
+    from fpdf.enums import XPos, YPos
+    pdf = FPDF(orientation = 'P', unit = 'mm', format='A4')
+    pdf.set_font("helvetica", size=12)
+    if len(figure_buffers)>0:
+        pdf.add_page()
+    for buffer in figure_buffers:
+        pdf.cell(0, 20, "Current month:", align = 'C', new_x=XPos.LEFT, new_y=YPos.NEXT)
+        pdf.image(io.BytesIO(buffer), w= 200)
+        done += 1
+        report(done)
+    for df in report_tables:
+        pdf.set_fill_color(230)
+        pdf.add_page()
+        pdf.set_font("helvetica", size=12)
+        pdf.cell(0, 20, table_title, align = 'C', new_x=XPos.LEFT, new_y=YPos.NEXT)
+        pdf.set_font("Times", size=8)
+        render_pdf_table(pdf, df.reset_index(), on_row=lambda rows: report(done + rows))
+        done += len(df)
+        report(done)
+    data = bytes(pdf.output())
+    report(total)
+    return data
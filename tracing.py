@@ -0,0 +1,120 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+#################################################################
+#                                                               #
+# Timings of the hot paths (HTTP, parsing, rollups, rendering)  #
+#                                                               #
+#################################################################
+# Cada etapa trazada deja un registro (span) con su duracion, filas y bytes.
+# Los ultimos TRACE_LIMIT se guardan en memoria para el panel de depuracion
+# (ui.show_trace_panel) y, si TIME_TRACKING_TRACE_LOG apunta a un fichero, se
+# escriben en el como JSON (una linea por span) a traves del logger
+# "time_tracking.trace". Este modulo no importa Streamlit.
+
+TRACE_LIMIT = 5000 # spans que se guardan en memoria
+
+logger = logging.getLogger("time_tracking.trace")
+if os.environ.get("TIME_TRACKING_TRACE_LOG"):
+    _handler = logging.FileHandler(os.environ["TIME_TRACKING_TRACE_LOG"])
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+_spans = deque(maxlen=TRACE_LIMIT)
+_spans_lock = threading.Lock()
+
+
+def count_rows(result):
+    """Rows of a stage result: dataframes, series and lists; tuples count their first item."""
+    if isinstance(result, tuple) and len(result) > 0:
+        return count_rows(result[0])
+    if isinstance(result, (pd.DataFrame, pd.Series, list, dict)):
+        return len(result)
+    return None
+
+
+def record(span):
+    with _spans_lock:
+        _spans.append(span)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(span))
+
+
+@contextmanager
+def trace(stage):
+    """
+    Times the block as one span of stage. The span is a dict: set
+    span['rows'] or span['bytes'] inside the block to record them.
+    """
+    span = {'stage': stage, 'start': time.time(), 'seconds': None, 'rows': None, 'bytes': None,
+            'thread': threading.current_thread().name, 'error': None}
+    started = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        span['error'] = type(e).__name__
+        raise
+    finally:
+        span['seconds'] = time.perf_counter() - started
+        record(span)
+
+
+def traced(function=None, stage=None):
+    """Decorator: every call is a span named after the function (or stage), with the rows of the result."""
+    def decorate(function):
+        name = stage or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace(name) as span:
+                result = function(*args, **kwargs)
+                span['rows'] = count_rows(result)
+                if isinstance(result, (bytes, bytearray)):
+                    span['bytes'] = len(result)
+                return result
+
+        if hasattr(function, 'clear'): # funciones con st.cache_data: el span incluye las llamadas servidas desde la cache
+            wrapper.clear = function.clear
+        return wrapper
+
+    if function is not None:
+        return decorate(function)
+    return decorate
+
+
+def get_spans(since=None):
+    """Recorded spans (newest last) started at or after since (time.time())."""
+    with _spans_lock:
+        spans = list(_spans)
+    if since is not None:
+        spans = [span for span in spans if span['start'] >= since]
+    return spans
+
+
+def summarize(spans):
+    """Calls, total and max seconds, rows and bytes by stage, slowest first."""
+    columns = ['stage', 'seconds', 'rows', 'bytes']
+    data = pd.DataFrame(spans, columns=columns + ['start', 'thread', 'error'])[columns]
+    summary = data.groupby('stage').agg(
+        calls=('seconds', 'size'),
+        seconds=('seconds', 'sum'),
+        max_seconds=('seconds', 'max'),
+        rows=('rows', lambda values: values.sum(min_count=1)),
+        bytes=('bytes', lambda values: values.sum(min_count=1)),
+    )
+    summary = summary.astype({'rows': 'Int64', 'bytes': 'Int64'}) # vacio si la etapa no los registra
+    return summary.sort_values('seconds', ascending=False)
+
+
+def start_trace():
+    """Marks the start of a script run; pass it to ui.show_trace_panel."""
+    return time.time()
@@ -0,0 +1,72 @@
+import json
+import time
+
+import pandas as pd
+import streamlit as st
+
+from common_functions import to_local_time
+from tracing import get_spans, summarize
+
+#################################################################
+#                                                               #
+# Streamlit components shared by the pages                      #
+#                                                               #
+#################################################################
+# Capa de interfaz: lo unico que necesita Streamlit. Los datos salen de
+# common_functions/local_store y los graficos y ficheros de rendering.
+
+MIME_TYPES = {
+    "pdf": "application/pdf",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "zip": "application/zip",
+}
+
+
+def show_failed_windows(failed):
+    """Warns about the time entry windows that could not be downloaded."""
+    if not failed:
+        return
+    starts = to_local_time(pd.Series([window[0] for window in failed])).dt.strftime('%d/%m/%Y')
+    ends = to_local_time(pd.Series([window[1] for window in failed])).dt.strftime('%d/%m/%Y')
+    periods = starts + ' - ' + ends
+    st.warning("No se pudieron descargar los registros de tiempo de: " + '; '.join(periods) + ". Se reintentará en la próxima sincronización.")
+
+
+def show_sync_error(error):
+    """Warns that the last background sync failed and older data is being shown."""
+    if error is None:
+        return
+    st.warning("La última sincronización con ClickUp falló (" + type(error).__name__ + ": " + str(error) + "). Se muestran los datos anteriores; se reintentará en la próxima carga.")
+
+
+def offer_download(data, filename, filetype, key=None):
+    # descarga binaria directa, sin incrustar el fichero en base64 en la pagina
+    st.download_button("Download " + filetype.upper(), data=data, file_name=filename + "." + filetype, mime=MIME_TYPES[filetype], key=key)
+
+
+def df2report(df):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    ax.set_axis_off()
+    the_table = ax.table(cellText=df.values, rowLabels=df.index, colLabels=df.columns)
+    the_table.auto_set_font_size(False)
+    the_table.set_fontsize(8)
+    st.pyplot(fig)
+    return fig
+
+
+def show_trace_panel(since):
+    """Optional sidebar panel with the timings of the current script run (and background work meanwhile)."""
+    if not st.sidebar.checkbox("Show timings (debug)", key="show_trace_panel"):
+        return
+    spans = get_spans(since)
+    st.sidebar.caption(str(len(spans)) + " spans, " + f"{time.time() - since:.2f}" + " s since the run started")
+    if len(spans) == 0:
+        return
+    st.sidebar.dataframe(summarize(spans))
+    st.sidebar.download_button(
+        "Download trace (JSON lines)",
+        data="\n".join(json.dumps(span) for span in get_spans()),
+        file_name="trace.jsonl",
+        mime="application/x-ndjson",
+    )